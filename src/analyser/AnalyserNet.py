@@ -13,12 +13,13 @@ from analyser.Score import Score
 from analyser.analyser_rnn import sequence_input, labels_output, tree_tokens_output, strings_output, \
     sequence_tokens_output
 from analyser.attention_dynamic_rnn import Attention
-from analyser.misc import cross_entropy_loss, l2_loss, batch_greedy_correct, calc_scores, print_diff, \
+from analyser.misc import cross_entropy_loss, l2_loss, batch_correct, calc_scores, print_diff, \
     print_scores, newest
 from contants import PAD, NOP, UNDEFINED
 from logger import logger
-from prepares import DataSet
+from prepares import DataSet, densify
 from utils.Formatter import Formatter
+from utils.Prefetcher import Prefetcher
 from utils.SummaryWriter import SummaryWriter
 from utils.wrappers import trace, Timer
 
@@ -35,12 +36,18 @@ class AnalyserNet:
         nop = Embeddings.tokens().get_index(NOP)
         pad = Embeddings.words().get_index(PAD)
         with tf.variable_scope("Input"), Timer("BUILD INPUT"):
-            self.inputs = tf.placeholder(tf.int32, [self.options.batch_size, None], "inputs")
-            self.inputs_length = tf.placeholder(tf.int32, [self.options.batch_size], "inputs_length")
+            # batches packed by options.token_budget differ in size, so the batch dimension stays unknown
+            self.inputs = tf.placeholder(tf.int32, [None, None], "inputs")
+            self.inputs_length = tf.placeholder(tf.int32, [None], "inputs_length")
             self.labels_length = tf.placeholder(tf.int32, [], "labels_length")
             self.tokens_length = tf.placeholder(tf.int32, [], "tokens_length")
             self.strings_length = tf.placeholder(tf.int32, [], "strings_length")
-            inputs = tf.gather(tf.constant(np.asarray(Embeddings.words().idx2emb)), self.inputs)
+            # the matrix is fed once by initialize, so it stays out of the GraphDef and the checkpoints
+            embeddings_shape = Embeddings.words().matrix.shape
+            self.embeddings_initializer = tf.placeholder(tf.float32, embeddings_shape, "embeddings_initializer")
+            self.embeddings = tf.Variable(
+                self.embeddings_initializer, trainable=False, collections=[], name="embeddings")
+            inputs = tf.gather(self.embeddings, self.inputs)
         with tf.variable_scope(scope or "Analyser", dtype=dtype) as scope, Timer("BUILD BODY"):
             dtype = scope.dtype
             cell_fw = GRUCell(self.options.inputs_state_size)
@@ -87,12 +94,14 @@ class AnalyserNet:
             self.tokens = confident(self.raw_tokens, 3, nop, self.options.token_confidence)
             self.strings = confident(self.raw_strings, 4, pad, self.options.string_confidence)
         with tf.variable_scope("Loss"), Timer("BUILD LOSS"):
-            self.labels_targets = tf.placeholder(tf.int32, [self.options.batch_size, None], "labels")
-            self.tokens_targets = tf.placeholder(tf.int32, [self.options.batch_size, None, None], "tokens")
-            self.strings_targets = tf.placeholder(tf.int32, [self.options.batch_size, None, None, None], "strings")
-            self.labels_loss = cross_entropy_loss(self.labels_targets, self.labels_logits, undefined)
-            self.tokens_loss = cross_entropy_loss(self.tokens_targets, self.tokens_logits, nop)
-            self.strings_loss = cross_entropy_loss(self.strings_targets, self.strings_logits, pad)
+            self.labels_targets = tf.placeholder(tf.int32, [None, None], "labels")
+            self.tokens_targets = tf.placeholder(tf.int32, [None, None, None], "tokens")
+            self.strings_targets = tf.placeholder(tf.int32, [None, None, None, None], "strings")
+            # rows with zero inputs length fill up partial batches
+            rows = tf.to_float(tf.greater(self.inputs_length, 0))
+            self.labels_loss = rows * cross_entropy_loss(self.labels_targets, self.labels_logits, undefined)
+            self.tokens_loss = rows * cross_entropy_loss(self.tokens_targets, self.tokens_logits, nop)
+            self.strings_loss = rows * cross_entropy_loss(self.strings_targets, self.strings_logits, pad)
             self.l2_loss = self.options.l2_weight * l2_loss(self.variables)
             self.loss = self.labels_loss + self.tokens_loss + self.strings_loss + self.l2_loss
         with tf.variable_scope("Optimizer"), Timer("BUILD OPTIMISER"):
@@ -103,6 +112,11 @@ class AnalyserNet:
         self.save_path = self.options.model_dir
         self.data_set = data_set
 
+    def initialize(self, session: tf.Session):
+        session.run(tf.global_variables_initializer())
+        feed_dict = {self.embeddings_initializer: Embeddings.words().matrix}
+        session.run(self.embeddings.initializer, feed_dict)
+
     def save(self, session: tf.Session):
         if not os.path.isdir(self.save_path):
             os.makedirs(self.save_path)
@@ -138,7 +152,7 @@ class AnalyserNet:
             self.strings_length: strings_length,
             self.labels_targets: labels_targets,
             self.tokens_targets: tokens_targets,
-            self.strings_targets: strings_targets}
+            self.strings_targets: densify(strings_targets)}
         return feed_dict
 
     def correct_target(self, feed_dict, session) -> dict:
@@ -156,19 +170,26 @@ class AnalyserNet:
         _labels_targets[_labels_targets == -1] = undefined
         _tokens_targets[_tokens_targets == -1] = nop
         _strings_targets[_strings_targets == -1] = pad
-        emb_labels_targets = np.asarray(Embeddings.labels().idx2emb)[_labels_targets]
-        emb_tokens_targets = np.asarray(Embeddings.tokens().idx2emb)[_tokens_targets]
+        emb_labels_targets = Embeddings.labels().matrix[_labels_targets]
+        emb_tokens_targets = Embeddings.tokens().matrix[_tokens_targets]
         num_words = len(Embeddings.words())
-        emb_strings_targets = np.eye(num_words)[_strings_targets]
+        emb_strings_targets = (_strings_targets[..., np.newaxis] == np.arange(num_words)).astype(np.float64)
         targets = (emb_labels_targets, emb_tokens_targets, emb_strings_targets)
         dependencies = (labels_targets, tokens_targets, strings_targets)
-        targets, dependencies = batch_greedy_correct(targets, outputs, dependencies)
+        targets, dependencies = batch_correct(targets, outputs, dependencies, self.options.correction_type)
         labels_targets, tokens_targets, strings_targets = dependencies
         feed_dict[self.labels_targets] = labels_targets
         feed_dict[self.tokens_targets] = tokens_targets
         feed_dict[self.strings_targets] = strings_targets
         return feed_dict
 
+    def feed_dicts(self, session: tf.Session, batches):
+        feed_dicts = (self.correct_target(self.build_feed_dict(batch), session) for batch in batches)
+        if not self.options.prefetch_depth:
+            return feed_dicts
+        # the targets of prefetched batches are corrected by weights at most prefetch_depth steps old
+        return Prefetcher(feed_dicts, self.options.prefetch_depth)
+
     @trace("TRAIN")
     def train(self):
         train_loss_graphs, validation_loss_graphs = [], []
@@ -207,12 +228,10 @@ class AnalyserNet:
         device = tf.device('/cpu:0')
         writer = SummaryWriter(self.options.summaries_dir, session, self.summaries, session.graph)
         with session, device, writer, figure0, figure1:
-            session.run(tf.global_variables_initializer())
+            self.initialize(session)
             for epoch in range(self.options.epochs):
                 with Timer(printer=None) as timer:
-                    for batch in self.data_set.train:
-                        feed_dict = self.build_feed_dict(batch)
-                        feed_dict = self.correct_target(feed_dict, session)
+                    for feed_dict in self.feed_dicts(session, self.data_set.train):
                         session.run(self.optimizer, feed_dict)
                 train_losses, train_scores = self.quality(session, self.data_set.train)
                 validation_losses, validation_scores = self.quality(session, self.data_set.validation)
@@ -271,7 +290,7 @@ class AnalyserNet:
         config = tf.ConfigProto()
         config.graph_options.optimizer_options.global_jit_level = tf.OptimizerOptions.ON_1
         with tf.Session(config=config) as session, tf.device('/cpu:0'):
-            session.run(tf.global_variables_initializer())
+            self.initialize(session)
             self.restore(session)
             if show_diff:
                 for batch in test_set:
@@ -281,8 +300,10 @@ class AnalyserNet:
                     tokens_fetches = (self.tokens_targets, self.tokens)
                     strings_fetches = (self.strings_targets, self.strings)
                     array = session.run(labels_fetches + tokens_fetches + strings_fetches, feed_dict)
-                    inputs = feed_dict[self.inputs]
-                    raw_tokens = session.run(self.raw_tokens, feed_dict)
+                    rows = feed_dict[self.inputs_length] > 0
+                    array = [value[rows] for value in array]
+                    inputs = feed_dict[self.inputs][rows]
+                    raw_tokens = session.run(self.raw_tokens, feed_dict)[rows]
                     print_diff(inputs, *array, raw_tokens)
             losses, scores = self.quality(session, test_set)
             print_scores(scores)
@@ -290,16 +311,16 @@ class AnalyserNet:
 
     def quality(self, session, batches):
         losses, scores = [], []
-        for batch in batches:
-            feed_dict = self.build_feed_dict(batch)
-            feed_dict = self.correct_target(feed_dict, session)
+        for feed_dict in self.feed_dicts(session, batches):
             labels_fetches = (self.labels_targets, self.labels)
             tokens_fetches = (self.tokens_targets, self.tokens)
             strings_fetches = (self.strings_targets, self.strings)
             array = session.run(labels_fetches + tokens_fetches + strings_fetches, feed_dict)
             losses_fetches = (self.labels_loss, self.tokens_loss, self.strings_loss, self.loss)
-            losses.append(session.run(losses_fetches, feed_dict))
+            rows = feed_dict[self.inputs_length] > 0
+            losses.append([loss[rows] for loss in session.run(losses_fetches, feed_dict)])
+            array = [value[rows] for value in array]
             scores.append(calc_scores(*array, self.options.flatten_type))
-        losses = [np.mean(typed_losses) for typed_losses in zip(*losses)]
+        losses = [np.mean(np.concatenate(typed_losses)) for typed_losses in zip(*losses)]
         scores = [Score.concat(typed_scores) for typed_scores in zip(*scores)]
         return losses, scores
@@ -1,39 +1,47 @@
-from typing import List, Dict, Tuple
+import glob
+import os
+import zlib
+from itertools import repeat
+from typing import List, Dict, Iterable, Tuple
 
 import numpy as np
 from contracts import Tokens, Types
 
 from contants import *
-# ToDo: thread save
-from contants import EMBEDDINGS_PATH
+from contants import EMBEDDINGS_PATH, EMBEDDINGS_VOCABULARY_PATH, EMBEDDINGS_MATRIX_PATH, \
+    EMBEDDINGS_REDUCED_MATRIX_PATH
 from utils import dumpers
-from utils.wrappers import memoize
+from utils.wrappers import memoize, static
 
 
 class Embeddings:
-    def __init__(self, instance: List[Tuple[str, np.array]], default_name: str = None):
-        self._instance = instance
+    def __init__(self, names: Iterable[str], matrix: np.ndarray, default_name: str = None, num_buckets: int = 0):
+        self._idx2name = list(names)
+        self._matrix = np.ascontiguousarray(matrix, np.float32)
+        self._name2idx = {name: i for i, name in enumerate(self._idx2name)}
+        assert len(self._idx2name) == len(self._matrix)
+        assert len(self._name2idx) == len(self._idx2name), "Embedding names must be unique"
         self.default_name = default_name
+        self.default_index = None if default_name is None else self._name2idx[default_name]
+        # the last num_buckets rows are shared by every name that isn't stored explicitly
+        self.num_buckets = num_buckets
+        self.buckets_offset = len(self._idx2name) - num_buckets
 
     @property
-    def instance(self) -> List[Tuple[str, np.array]]:
-        return self._instance
+    def matrix(self) -> np.ndarray:
+        return self._matrix
 
-    @memoize.read_only_property
-    def name2emb(self) -> Dict[str, np.array]:
-        return {name: embedding for name, embedding in self._instance}
-
-    @memoize.read_only_property
+    @property
     def idx2name(self) -> List[str]:
-        return [name for name, embedding in self.instance]
+        return self._idx2name
 
-    @memoize.read_only_property
-    def idx2emb(self) -> List[np.ndarray]:
-        return [embedding for name, embedding in self.instance]
+    @property
+    def name2idx(self) -> Dict[str, int]:
+        return self._name2idx
 
     @memoize.read_only_property
-    def name2idx(self) -> dict:
-        return {word: i for i, (word, embedding) in enumerate(self.instance)}
+    def names(self) -> np.ndarray:
+        return np.asarray(self._idx2name, dtype=object)
 
     def get_store(self, key):
         if key is None:
@@ -41,18 +49,20 @@ class Embeddings:
         # noinspection PyUnresolvedReferences
         if isinstance(key, (int, np.number)):
             index = int(key)
-            if index < 0 or index >= len(self.instance):
+            if index < 0 or index >= len(self):
                 raise ValueError("Store with index '%d' hasn't found" % key)
         elif isinstance(key, str):
-            if key in self.name2idx:
-                index = self.name2idx[key]
-            elif self.default_name is not None:
-                index = self.name2idx[self.default_name]
+            if key in self._name2idx:
+                index = self._name2idx[key]
+            elif self.num_buckets > 0:
+                index = self.bucket(key)
+            elif self.default_index is not None:
+                index = self.default_index
             else:
                 raise ValueError("Store with name '%s' hasn't found" % key)
         else:
             raise ValueError("Key with type %s hasn't supported" % type(key))
-        return index, self.idx2name[index], self.idx2emb[index]
+        return index, self._idx2name[index], self._matrix[index]
 
     def get_index(self, key) -> int:
         return self.get_store(key)[0]
@@ -63,33 +73,171 @@ class Embeddings:
     def get_embedding(self, key) -> np.array:
         return self.get_store(key)[2]
 
+    def bucket(self, name: str) -> int:
+        return self.buckets_offset + zlib.crc32(name.encode("utf8")) % self.num_buckets
+
+    def is_bucket(self, indices) -> np.ndarray:
+        return np.asarray(indices) >= self.buckets_offset
+
+    def get_indices(self, names: Iterable[str]) -> np.ndarray:
+        names = list(names)
+        if self.num_buckets > 0:
+            indices = (self._name2idx.get(name) for name in names)
+            indices = (self.bucket(name) if index is None else index for name, index in zip(names, indices))
+            return np.fromiter(indices, np.int32, len(names))
+        default = -1 if self.default_index is None else self.default_index
+        indices = np.fromiter(map(self._name2idx.get, names, repeat(default)), np.int32, len(names))
+        if self.default_index is None and np.any(indices < 0):
+            raise ValueError("Store with name '%s' hasn't found" % names[int(np.argmin(indices))])
+        return indices
+
+    def get_names(self, indices) -> np.ndarray:
+        indices = np.asarray(indices)
+        if indices.size > 0 and (np.min(indices) < 0 or np.max(indices) >= len(self)):
+            raise ValueError("Store with index out of [0, %d) hasn't found" % len(self))
+        return self.names[indices]
+
     def __len__(self):
-        return len(self.instance)
+        return len(self._idx2name)
+
+
+def dump_words(embeddings: Dict[str, np.ndarray], counts: Dict[str, int] = None):
+    embedding_size = max(len(embedding) for embedding in embeddings.values())
+    embeddings = dict(embeddings)
+    embeddings[GO] = np.ones([embedding_size], np.float32)
+    embeddings[PAD] = np.zeros([embedding_size], np.float32)
+    counts = counts or {}
+    names = sorted(embeddings)
+    # both files are written aside and moved in place, the vocabulary last because words() starts from it
+    vocabulary_path = "%s.%d.tmp" % (EMBEDDINGS_VOCABULARY_PATH, os.getpid())
+    matrix_path = "%s.%d.tmp" % (EMBEDDINGS_MATRIX_PATH, os.getpid())
+    with open(vocabulary_path, "w", encoding="utf8") as file:
+        for name in names:
+            file.write("%s %d\n" % (name, counts.get(name, 0)))
+    dumpers.npy_dump([np.asarray(embeddings[name], np.float32) for name in names], matrix_path)
+    # reduced matrices belong to the previous vocabulary
+    for path in glob.glob(EMBEDDINGS_REDUCED_MATRIX_PATH.replace("%d", "*")):
+        os.remove(path)
+    os.replace(matrix_path, EMBEDDINGS_MATRIX_PATH)
+    os.replace(vocabulary_path, EMBEDDINGS_VOCABULARY_PATH)
+
+
+def convert_words():
+    dump_words(dumpers.pkl_load(EMBEDDINGS_PATH))
+
+
+def load_vocabulary() -> Tuple[List[str], List[int]]:
+    names, counts = [], []
+    with open(EMBEDDINGS_VOCABULARY_PATH, "r", encoding="utf8") as file:
+        for line in file:
+            name, count = line.rstrip("\n").rsplit(" ", 1)
+            names.append(name)
+            counts.append(int(count))
+    return names, counts
+
+
+def bucketed_words(names: List[str], counts: List[int], matrix: np.ndarray, size: int, num_buckets: int):
+    # keeps the reserved names and the size most frequent words, merges the rest into buckets weighted by their counts
+    assert size > 0 and num_buckets > 0
+    if not any(counts):
+        raise ValueError("Word counts haven't found in '%s', retrain word2vec to use bucketed vocabulary"
+                         % EMBEDDINGS_VOCABULARY_PATH)
+    reserved = (GO, PAD, "UNK")
+    order = sorted(range(len(names)), key=lambda i: (names[i] not in reserved, -counts[i], names[i]))
+    size += sum(name in reserved for name in names)
+    kept = sorted(order[:size])
+    rare = np.asarray(order[size:], np.int64)
+    bucket_names = ["@bucket-%d" % i for i in range(num_buckets)]
+    buckets = np.fromiter((zlib.crc32(names[i].encode("utf8")) % num_buckets for i in rare), np.int64, len(rare))
+    weights = np.maximum(np.asarray(counts, np.float32)[rare], 1)
+    sums = np.zeros([num_buckets, matrix.shape[1]], np.float32)
+    totals = np.zeros([num_buckets], np.float32)
+    np.add.at(sums, buckets, matrix[rare] * weights[:, np.newaxis])
+    np.add.at(totals, buckets, weights)
+    sums /= np.maximum(totals, 1)[:, np.newaxis]
+    names = [names[i] for i in kept] + bucket_names
+    matrix = np.concatenate([matrix[kept], sums])
+    return Embeddings(names, matrix, "UNK", num_buckets)
+
+
+def reduce_words(dimension: int, method: str = "pca", seed: int = 0) -> float:
+    names, _ = load_vocabulary()
+    matrix = np.asarray(dumpers.npy_load(EMBEDDINGS_MATRIX_PATH), np.float64).reshape([len(names), -1])
+    if dimension >= matrix.shape[1]:
+        raise ValueError("Dimension %d isn't less than %d" % (dimension, matrix.shape[1]))
+    go, pad = names.index(GO), names.index(PAD)
+    rows = np.asarray([i for i in range(len(names)) if i not in (go, pad)])
+    mean = matrix[rows].mean(0)
+    centered = matrix[rows] - mean
+    if method == "pca":
+        _, _, components = np.linalg.svd(centered, full_matrices=False)
+        projection = components[:dimension].T
+        reduced = (matrix - mean) @ projection
+    elif method == "random":
+        # Johnson-Lindenstrauss projection, preserves norms and distances in expectation
+        projection = np.random.RandomState(seed).normal(0, 1 / np.sqrt(dimension), [matrix.shape[1], dimension])
+        reduced = matrix @ projection
+        projection, _ = np.linalg.qr(projection)
+    else:
+        raise ValueError("Reduction method '%s' hasn't recognised" % method)
+    # share of the variance kept by the projection subspace
+    retained = np.square(centered @ projection).sum() / np.square(centered).sum()
+    reduced[go] = 1
+    reduced[pad] = 0
+    path = EMBEDDINGS_REDUCED_MATRIX_PATH % dimension
+    temp_path = "%s.%d.tmp" % (path, os.getpid())
+    with open(temp_path, "wb") as file:
+        np.save(file, reduced.astype(np.float32))
+    os.replace(temp_path, path)
+    return float(retained)
+
+
+@static(size=None, num_buckets=0, dimension=None)
+def set_words(size: int = None, num_buckets: int = 0, dimension: int = None):
+    set_words.size = size
+    set_words.num_buckets = num_buckets or 0
+    set_words.dimension = dimension
+    words.cache.clear()
+
+
+def words_options() -> dict:
+    # the word ids of a prepared data set are valid only with the same vocabulary options
+    return {
+        "vocabulary_size": set_words.size,
+        "vocabulary_buckets": set_words.num_buckets,
+        "embeddings_dimension": set_words.dimension}
 
 
 @memoize.function
 def words() -> Embeddings:
-    instance = dumpers.pkl_load(EMBEDDINGS_PATH)
-    embedding_size = max(len(embedding) for embedding in instance.values())
-    instance[GO] = np.ones([embedding_size], np.float32)
-    instance[PAD] = np.zeros([embedding_size], np.float32)
-    instance = list(instance.items())
-    instance.sort(key=lambda x: x[0])
-    return Embeddings(instance, "UNK")
+    if not os.path.isfile(EMBEDDINGS_VOCABULARY_PATH):
+        raise ValueError("Vocabulary '%s' hasn't found, convert the embeddings by word2vec_main --convert"
+                         % EMBEDDINGS_VOCABULARY_PATH)
+    names, counts = load_vocabulary()
+    if set_words.dimension is None:
+        path = EMBEDDINGS_MATRIX_PATH
+        matrix = dumpers.npy_load(path)
+        matrix = matrix.reshape([len(names), -1]) if matrix.size % len(names) == 0 else matrix
+    else:
+        path = EMBEDDINGS_REDUCED_MATRIX_PATH % set_words.dimension
+        matrix = dumpers.npy_load(path)
+    if matrix.ndim != 2 or len(matrix) != len(names) or \
+            set_words.dimension is not None and matrix.shape[1] != set_words.dimension:
+        raise ValueError("Matrix '%s' with shape %s doesn't match vocabulary '%s' of %d words"
+                         % (path, matrix.shape, EMBEDDINGS_VOCABULARY_PATH, len(names)))
+    if set_words.num_buckets > 0:
+        return bucketed_words(names, counts, matrix, set_words.size, set_words.num_buckets)
+    return Embeddings(names, matrix, "UNK")
 
 
 @memoize.function
 def tokens() -> Embeddings:
     names = Tokens.instances[Types.OPERATOR] + Tokens.instances[Types.MARKER]
     names += (NOP, PARAM_0, PARAM_1, PARAM_2, PARAM_3, PARAM_4, PARAM_5, Types.STRING)
-    embeddings = list(np.eye(len(names)))
-    instance = list(zip(names, embeddings))
-    return Embeddings(instance)
+    return Embeddings(names, np.eye(len(names)))
 
 
 @memoize.function
 def labels() -> Embeddings:
     names = Tokens.instances[Types.LABEL] + (UNDEFINED,)
-    embeddings = list(np.eye(len(names)))
-    instance = list(zip(names, embeddings))
-    return Embeddings(instance)
+    return Embeddings(names, np.eye(len(names)))
@@ -18,6 +18,13 @@ class Options:
         self.label_confidence = None
         self.token_confidence = None
         self.string_confidence = None
+        self.vocabulary_size = None
+        self.vocabulary_buckets = None
+        self.embeddings_dimension = None
+        self.bucketing = None
+        self.token_budget = None
+        self.prefetch_depth = None
+        self.correction_type = None
 
     def validate(self):
         assert self.epochs is not None
@@ -37,6 +44,15 @@ class Options:
         assert self.label_confidence is not None
         assert self.token_confidence is not None
         assert self.string_confidence is not None
+        assert self.vocabulary_buckets is None or self.vocabulary_buckets >= 0
+        assert not self.vocabulary_buckets or self.vocabulary_size is not None
+        # the vocabulary is cut only in bucketed mode, GO, PAD and UNK are kept on top of vocabulary_size words
+        assert self.vocabulary_size is None or self.vocabulary_buckets
+        assert self.vocabulary_size is None or self.vocabulary_size > 0
+        assert self.embeddings_dimension is None or self.embeddings_dimension > 0
+        assert self.token_budget is None or self.token_budget > 0
+        assert self.prefetch_depth is None or self.prefetch_depth >= 0
+        assert self.correction_type in (None, "greedy", "hungarian")
 
     @staticmethod
     def value_of(json_object: dict) -> 'Options':
@@ -60,6 +76,13 @@ class Options:
         options.label_confidence = json_object.get("label_confidence", None)
         options.token_confidence = json_object.get("token_confidence", None)
         options.string_confidence = json_object.get("string_confidence", None)
+        options.vocabulary_size = json_object.get("vocabulary_size", None)
+        options.vocabulary_buckets = json_object.get("vocabulary_buckets", None)
+        options.embeddings_dimension = json_object.get("embeddings_dimension", None)
+        options.bucketing = json_object.get("bucketing", None)
+        options.token_budget = json_object.get("token_budget", None)
+        options.prefetch_depth = json_object.get("prefetch_depth", None)
+        options.correction_type = json_object.get("correction_type", "greedy")
         return options
 
     def serialize(self) -> dict:
@@ -81,5 +104,12 @@ class Options:
             "flatten_type": str(self.flatten_type),
             "label_confidence": float(self.label_confidence),
             "token_confidence": float(self.token_confidence),
-            "string_confidence": float(self.string_confidence)}
+            "string_confidence": float(self.string_confidence),
+            "vocabulary_size": self.vocabulary_size,
+            "vocabulary_buckets": self.vocabulary_buckets,
+            "embeddings_dimension": self.embeddings_dimension,
+            "bucketing": bool(self.bucketing),
+            "token_budget": self.token_budget,
+            "prefetch_depth": self.prefetch_depth,
+            "correction_type": self.correction_type}
         return json_object
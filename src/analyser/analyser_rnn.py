@@ -21,6 +21,8 @@ def sequence_input(cell_fw, cell_bw, inputs, inputs_length, hidden_size=None,
                    dtype=None, scope=None):
     batch_size = inputs.get_shape()[0].value
     assert batch_size == inputs_length.get_shape()[0].value, "Batch sizes of inputs and inputs lengths must be equals"
+    if batch_size is None:
+        batch_size = array_ops.shape(inputs)[0]
     input_length = array_ops.shape(inputs)[1]
     input_size = inputs.get_shape()[2].value
     if hidden_size is None:
@@ -132,9 +134,9 @@ def tree_tokens_output(cell, attention, output_size, output_length, initial_stat
     if output_height is None:
         output_height = _output_height
     assert initial_states is None or _output_height == output_height
-    batch_size = initial_states.get_shape()[1].value
+    batch_size = attention.batch_size
     initial_state_size = initial_states.get_shape()[2].value
-    assert batch_size == attention.batch_size
+    assert initial_states.get_shape()[1].value == attention.static_batch_size
 
     with vs.variable_scope(scope or "TreeTokensOutput", dtype=dtype) as scope:
         dtype = scope.dtype
@@ -191,9 +193,10 @@ def strings_output(cell, attention, output_size, output_length, initial_states,
         hidden_size = cell.output_size
     output_width = array_ops.shape(initial_states)[0]
     output_height = array_ops.shape(initial_states)[1]
-    batch_size = initial_states.get_shape()[2].value
+    batch_size = attention.batch_size
+    static_batch_size = attention.static_batch_size
     initial_state_size = initial_states.get_shape()[3].value
-    assert batch_size == attention.batch_size
+    assert initial_states.get_shape()[2].value == static_batch_size
 
     with vs.variable_scope(scope or "StringsOutput", dtype=dtype) as scope:
         dtype = scope.dtype
@@ -213,16 +216,16 @@ def strings_output(cell, attention, output_size, output_length, initial_states,
         initial_states = array_ops.reshape(initial_states, shape)
 
         with vs.variable_scope("Arrays"):
-            shape = [None, None, batch_size, state_size]
+            shape = [None, None, static_batch_size, state_size]
             state_ta = ta_ops.TensorArray(dtype, output_width, None, None, "states", element_shape=shape)
             weights_ta = []
             for i in range(attention.length):
-                shape = [None, None, batch_size, None]
+                shape = [None, None, static_batch_size, None]
                 ta = ta_ops.TensorArray(dtype, output_width, None, None, "weights_%d" % i, element_shape=shape)
                 weights_ta.append(ta)
             attentions_ta = []
             for i in range(attention.length):
-                shape = [None, None, batch_size, attention.input_size]
+                shape = [None, None, static_batch_size, attention.input_size]
                 ta = ta_ops.TensorArray(dtype, output_width, None, None, "attentions_%d" % i, element_shape=shape)
                 attentions_ta.append(ta)
 
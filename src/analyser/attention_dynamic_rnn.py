@@ -41,15 +41,20 @@ class Attention:
         assert self._num_inputs > 0, "With less than 1 inputs, not use a attention."
         self._input_size = None
         self._batch_size = None
+        self._static_batch_size = None
         for input in self._inputs:
             input_size = input.get_shape()[2].value
             assert input_size is not None, "Shape[2] of inputs must be known: %s" % input.get_shape()
             assert self._input_size is None or self._input_size == input_size, "Shape[2] of inputs must be equals for any inputs"
             self._input_size = input_size
-            batch_size = input.get_shape()[0].value
-            assert batch_size is not None, "Shape[0] of inputs must be known: %s" % input.get_shape()
-            assert self._batch_size is None or self._batch_size == batch_size, "Shape[0] of inputs must be equals for any inputs"
-            self._batch_size = batch_size
+            # shape[0] may be unknown for variable batch sizes, then it's taken from the first input at run time
+            static_batch_size = input.get_shape()[0].value
+            assert self._batch_size is None or self._static_batch_size == static_batch_size, "Shape[0] of inputs must be equals for any inputs"
+            self._static_batch_size = static_batch_size
+            if self._batch_size is None:
+                self._batch_size = static_batch_size
+                if static_batch_size is None:
+                    self._batch_size = array_ops.shape(input)[0]
 
         with vs.variable_scope(scope or "Attention", dtype=dtype) as scope:
             self._scope = scope
@@ -123,6 +128,10 @@ class Attention:
     def batch_size(self):
         return self._batch_size
 
+    @property
+    def static_batch_size(self):
+        return self._static_batch_size
+
     @property
     def input_size(self):
         return self._input_size
@@ -247,13 +256,14 @@ def attention_tree_dynamic_rnn(cell, inputs, attention, output_size=None,
                                initial_state=None, loop_function=None,
                                initial_state_attention=True, dtype=None, scope=None):
     assert isinstance(cell, (list, tuple)) and len(cell) == 2
-    assert inputs.get_shape()[1].value == attention.batch_size
+    assert inputs.get_shape()[1].value == attention.static_batch_size
     assert attention.state_size == cell[0].state_size
     assert attention.state_size == cell[1].state_size
     assert cell[0].output_size == cell[1].output_size
     assert initial_state is None or initial_state.get_shape()[1].value == attention.state_size
     left_cell, right_cell = cell
-    batch_size = inputs.get_shape()[1].value
+    batch_size = attention.batch_size
+    static_batch_size = attention.static_batch_size
     input_size = inputs.get_shape()[2].value
     state_size = attention.state_size
     if output_size is None:
@@ -275,18 +285,18 @@ def attention_tree_dynamic_rnn(cell, inputs, attention, output_size=None,
             B_out = vs.get_variable(_BIAS_NAME, [output_size], dtype, bias_initializer)
 
         with vs.variable_scope("Arrays"):
-            shape = [batch_size, state_size]
+            shape = [static_batch_size, state_size]
             state_ta = ta_ops.TensorArray(dtype, output_length, None, False, "states", element_shape=shape)
-            shape = [batch_size, output_size]
+            shape = [static_batch_size, output_size]
             output_ta = ta_ops.TensorArray(dtype, output_length, None, False, "outputs", element_shape=shape)
             weights_ta = []
             for i in range(attention.length):
-                shape = [batch_size, None]
+                shape = [static_batch_size, None]
                 ta = ta_ops.TensorArray(dtype, output_length, None, None, "weights_%d" % i, element_shape=shape)
                 weights_ta.append(ta)
             attentions_ta = []
             for i in range(attention.length):
-                shape = [batch_size, attention.input_size]
+                shape = [static_batch_size, attention.input_size]
                 ta = ta_ops.TensorArray(dtype, output_length, None, False, "attentions_%d" % i, element_shape=shape)
                 attentions_ta.append(ta)
 
@@ -370,7 +380,7 @@ def stack_attention_tree_dynamic_rnn(cell, inputs, attention, output_size=None,
     :return:
     """
     assert isinstance(cell, (list, tuple)) and len(cell) == 2
-    assert inputs.get_shape()[1].value == attention.batch_size
+    assert inputs.get_shape()[1].value == attention.static_batch_size
     assert attention.state_size == cell[0].state_size
     assert attention.state_size == cell[1].state_size
     assert cell[0].output_size == cell[1].output_size
@@ -382,7 +392,7 @@ def stack_attention_tree_dynamic_rnn(cell, inputs, attention, output_size=None,
     assert stack_function is not None or output_size is None or output_size == input_size
     output_size = input_size if stack_function is None else output_size
     input_length = inputs.get_shape()[0]
-    batch_size = inputs.get_shape()[1].value
+    static_batch_size = attention.static_batch_size
     if output_size is None:
         output_size = cell[0].output_size
     state_size = cell[0].state_size
@@ -391,18 +401,18 @@ def stack_attention_tree_dynamic_rnn(cell, inputs, attention, output_size=None,
         dtype = stack_scope.dtype
 
         with vs.variable_scope("Arrays"):
-            shape = [input_length.value, batch_size, state_size]
+            shape = [input_length.value, static_batch_size, state_size]
             state_ta = ta_ops.TensorArray(dtype, stack_size, None, None, "states", element_shape=shape)
-            shape = [input_length.value, batch_size, output_size]
+            shape = [input_length.value, static_batch_size, output_size]
             output_ta = ta_ops.TensorArray(dtype, stack_size, None, None, "outputs", element_shape=shape)
             weights_ta = []
             for i in range(attention.length):
-                shape = [input_length.value, batch_size, None]
+                shape = [input_length.value, static_batch_size, None]
                 ta = ta_ops.TensorArray(dtype, stack_size, None, None, "weights_%d" % i, element_shape=shape)
                 weights_ta.append(ta)
             attentions_ta = []
             for i in range(attention.length):
-                shape = [input_length.value, batch_size, attention.input_size]
+                shape = [input_length.value, static_batch_size, attention.input_size]
                 ta = ta_ops.TensorArray(dtype, stack_size, None, None, "attentions_%d" % i, element_shape=shape)
                 attentions_ta.append(ta)
 
@@ -441,8 +451,9 @@ def stack_attention_tree_dynamic_rnn(cell, inputs, attention, output_size=None,
 def attention_dynamic_rnn(cell, inputs, attention, output_size=None, initial_output=None,
                           initial_state=None, loop_function=None,
                           initial_state_attention=True, dtype=None, scope=None):
-    batch_size = inputs.get_shape()[1].value
-    assert batch_size == attention.batch_size
+    assert inputs.get_shape()[1].value == attention.static_batch_size
+    batch_size = attention.batch_size
+    static_batch_size = attention.static_batch_size
     assert attention.state_size == cell.state_size
     input_size = inputs.get_shape()[2].value
     if output_size is None:
@@ -462,18 +473,18 @@ def attention_dynamic_rnn(cell, inputs, attention, output_size=None, initial_out
             B_out = vs.get_variable(_BIAS_NAME, [output_size], dtype, bias_initializer)
 
         with vs.variable_scope("Arrays"):
-            shape = [batch_size, state_size]
+            shape = [static_batch_size, state_size]
             state_ta = ta_ops.TensorArray(dtype, output_length, None, None, "states", element_shape=shape)
-            shape = [batch_size, output_size]
+            shape = [static_batch_size, output_size]
             output_ta = ta_ops.TensorArray(dtype, output_length, None, None, "outputs", element_shape=shape)
             weights_ta = []
             for i in range(attention.length):
-                shape = [batch_size, None]
+                shape = [static_batch_size, None]
                 ta = ta_ops.TensorArray(dtype, output_length, None, None, "weights_%d" % i, element_shape=shape)
                 weights_ta.append(ta)
             attentions_ta = []
             for i in range(attention.length):
-                shape = [batch_size, attention.input_size]
+                shape = [static_batch_size, attention.input_size]
                 ta = ta_ops.TensorArray(dtype, output_length, None, None, "attentions_%d" % i, element_shape=shape)
                 attentions_ta.append(ta)
 
@@ -529,8 +540,8 @@ def attention_dynamic_rnn(cell, inputs, attention, output_size=None, initial_out
 def stack_attention_dynamic_rnn(cell, inputs, attention, output_size=None, initial_outputs=None,
                                 stack_size=None, initial_states=None, loop_function=None, stack_function=None,
                                 initial_state_attention=True, dtype=None, scope=None, stack_scope=None):
-    batch_size = inputs.get_shape()[1].value
-    assert attention.batch_size == batch_size
+    static_batch_size = attention.static_batch_size
+    assert inputs.get_shape()[1].value == static_batch_size
     state_size = cell.state_size
     assert attention.state_size == state_size
     assert initial_states is None or initial_states.get_shape()[2].value == state_size
@@ -548,18 +559,18 @@ def stack_attention_dynamic_rnn(cell, inputs, attention, output_size=None, initi
         dtype = stack_scope.dtype
 
         with vs.variable_scope("Arrays"):
-            shape = [None, batch_size, state_size]
+            shape = [None, static_batch_size, state_size]
             state_ta = ta_ops.TensorArray(dtype, stack_size, None, None, "states", element_shape=shape)
-            shape = [None, batch_size, output_size]
+            shape = [None, static_batch_size, output_size]
             output_ta = ta_ops.TensorArray(dtype, stack_size, None, None, "outputs", element_shape=shape)
             weights_ta = []
             for i in range(attention.length):
-                shape = [None, batch_size, None]
+                shape = [None, static_batch_size, None]
                 ta = ta_ops.TensorArray(dtype, stack_size, None, None, "weights_%d" % i, element_shape=shape)
                 weights_ta.append(ta)
             attentions_ta = []
             for i in range(attention.length):
-                shape = [None, batch_size, attention.input_size]
+                shape = [None, static_batch_size, attention.input_size]
                 ta = ta_ops.TensorArray(dtype, stack_size, None, None, "attentions_%d" % i, element_shape=shape)
                 attentions_ta.append(ta)
 
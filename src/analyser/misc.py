@@ -1,5 +1,4 @@
 import enum
-import itertools
 import os
 import re
 from typing import Iterable, Any, List
@@ -45,95 +44,89 @@ def l2_loss(variables):
     return loss
 
 
-def greedy_correct(targets, outputs, dependencies):
-    length = max(len(output) for output in outputs)
-    assert length == min(len(output) for output in outputs)
-    assert length == max(len(target) for target in targets)
-    assert length == min(len(target) for target in targets)
-    assert length == max(len(dependency) for dependency in dependencies)
-    assert length == min(len(dependency) for dependency in dependencies)
-    result_targets = [None] * length
-    result_dependencies = [None] * length
-    from_indexes = list(range(length))
-    to_indexes = list(range(length))
+def distances(targets, outputs) -> np.ndarray:
+    # distances[b, i, j] is the sum of the norms between targets[k][b, i] and outputs[k][b, j] over all k, every
+    # norm is taken from |t|^2 + |o|^2 - 2 t.o, so the [batch x length x length x ...] differences aren't built
+    result = None
+    for target, output in zip(targets, outputs):
+        target = np.asarray(target, np.float64)
+        output = np.asarray(output, np.float64)
+        assert target.shape == output.shape
+        target = target.reshape(target.shape[0], target.shape[1], -1)
+        output = output.reshape(output.shape[0], output.shape[1], -1)
+        squares = np.einsum("bik,bik->bi", target, target)[:, :, np.newaxis] + \
+                  np.einsum("bjk,bjk->bj", output, output)[:, np.newaxis, :]
+        squares -= 2 * np.einsum("bik,bjk->bij", target, output)
+        distance = np.sqrt(np.maximum(squares, 0))
+        result = distance if result is None else result + distance
+    return result
+
+
+def greedy_assignment(costs: np.ndarray) -> np.ndarray:
+    # permutations[b, to] = from, every round takes the cheapest free pair of each batch element at once
+    batch_size, length, _ = costs.shape
+    costs = np.array(costs, np.float64)
+    rows = np.arange(batch_size)
+    permutations = np.empty((batch_size, length), np.int64)
     for _ in range(length):
-        index_best_from_index = None
-        index_best_to_index = None
-        best_distance = None
-        for i, from_index in enumerate(from_indexes):
-            for j, to_index in enumerate(to_indexes):
-                distance = 0
-                for target, output in zip(targets, outputs):
-                    from_target = np.asarray(target[from_index])
-                    to_output = np.asarray(output[to_index])
-                    distance += np.linalg.norm(from_target - to_output)
-                if best_distance is None or distance < best_distance:
-                    index_best_from_index = i
-                    index_best_to_index = j
-                    best_distance = distance
-        best_from_index = from_indexes[index_best_from_index]
-        best_to_index = to_indexes[index_best_to_index]
-        del from_indexes[index_best_from_index]
-        del to_indexes[index_best_to_index]
-        result_targets[best_to_index] = [target[best_from_index] for target in targets]
-        result_dependencies[best_to_index] = [dependency[best_from_index] for dependency in dependencies]
-    assert len(from_indexes) == 0
-    assert len(to_indexes) == 0
-    result_targets = [np.asarray(target) for target in zip(*result_targets)]
-    result_dependencies = [np.asarray(dependency) for dependency in zip(*result_dependencies)]
+        from_indices, to_indices = np.divmod(np.argmin(costs.reshape(batch_size, -1), 1), length)
+        permutations[rows, to_indices] = from_indices
+        costs[rows, from_indices, :] = np.inf
+        costs[rows, :, to_indices] = np.inf
+    return permutations
+
+
+def hungarian_assignment(costs: np.ndarray) -> np.ndarray:
+    # shortest augmenting path variant of the hungarian method, O(length^3) with the column scans vectorized
+    def solve(cost: np.ndarray) -> np.ndarray:
+        length = len(cost)
+        u = np.zeros(length + 1)
+        v = np.zeros(length + 1)
+        matches = np.zeros(length + 1, np.int64)
+        way = np.zeros(length + 1, np.int64)
+        for i in range(1, length + 1):
+            matches[0] = i
+            column = 0
+            minimums = np.full(length + 1, np.inf)
+            used = np.zeros(length + 1, np.bool_)
+            while matches[column] != 0:
+                used[column] = True
+                row = matches[column]
+                free = ~used
+                reduced = cost[row - 1] - u[row] - v[1:]
+                better = free[1:] & (reduced < minimums[1:])
+                minimums[1:][better] = reduced[better]
+                way[1:][better] = column
+                candidates = np.where(free, minimums, np.inf)
+                column = int(np.argmin(candidates[1:])) + 1
+                delta = candidates[column]
+                u[matches[used]] += delta
+                v[used] -= delta
+                minimums[free] -= delta
+            while column != 0:
+                previous = way[column]
+                matches[column] = matches[previous]
+                column = previous
+        return matches[1:] - 1
+
+    return np.asarray([solve(np.asarray(cost, np.float64)) for cost in costs], np.int64)
+
+
+def batch_correct(targets, outputs, dependencies, correction_type: str = None):
+    correction_type = correction_type or "greedy"
+    if correction_type not in ("greedy", "hungarian"):
+        raise ValueError("Correction type '%s' hasn't recognised" % correction_type)
+    costs = distances(targets, outputs)
+    if correction_type == "greedy":
+        permutations = greedy_assignment(costs)
+    if correction_type == "hungarian":
+        permutations = hungarian_assignment(costs)
+    rows = np.arange(len(permutations))[:, np.newaxis]
+    result_targets = [np.asarray(target)[rows, permutations] for target in targets]
+    result_dependencies = [np.asarray(dependency)[rows, permutations] for dependency in dependencies]
     return result_targets, result_dependencies
 
 
-def batch_greedy_correct(targets, outputs, dependencies):
-    batch_size = max(len(output) for output in outputs)
-    assert batch_size == min(len(output) for output in outputs)
-    assert batch_size == max(len(target) for target in targets)
-    assert batch_size == min(len(target) for target in targets)
-    assert batch_size == max(len(dependency) for dependency in dependencies)
-    assert batch_size == min(len(dependency) for dependency in dependencies)
-    result_targets, result_dependencies = [], []
-    for i in range(batch_size):
-        target = [target[i] for target in targets]
-        output = [output[i] for output in outputs]
-        dependency = [dependency[i] for dependency in dependencies]
-        target, dependency = greedy_correct(target, output, dependency)
-        result_targets.append(target)
-        result_dependencies.append(dependency)
-    result_targets = [np.asarray(target) for target in zip(*result_targets)]
-    result_dependencies = [np.asarray(dependency) for dependency in zip(*result_dependencies)]
-    return result_targets, result_dependencies
-
-
-def nearest_correct(targets, outputs, fine_weigh):
-    tokens_targets, strings_targets, strings_mask = targets
-    tokens, strings = outputs
-    tokens_targets_values = np.asarray(Embeddings.tokens().idx2emb)[tokens_targets]
-    result_tokens = []
-    result_strings = []
-    result_strings_mask = []
-    batch_size = tokens.shape[0]
-    contract_size = tokens.shape[1]
-    for i in range(batch_size):
-        default_indexes = np.arange(contract_size)
-        best_indices = None
-        for indexes in itertools.permutations(default_indexes):
-            list_indexes = list(indexes)
-            perm = tokens_targets_values[i][list_indexes]
-            distance = np.linalg.norm(perm[1:] - tokens[i][1:])
-            fine = fine_weigh * np.linalg.norm(default_indexes - indexes)
-            distance = distance + fine
-            if best_distance is None or distance < best_distance:
-                best_indices = list_indexes
-                best_distance = distance
-        result_tokens.append(tokens_targets[i][best_indices])
-        result_strings.append(strings_targets[i][best_indices])
-        result_strings_mask.append(strings_mask[i][best_indices])
-    result_tokens = np.asarray(result_tokens)
-    result_strings = np.asarray(result_strings)
-    result_strings_mask = np.asarray(result_strings_mask)
-    return result_tokens, result_strings, result_strings_mask
-
-
 def transpose_attention(attentions, num_heads=1):
     """
         `[a x b x c]` is tensor with shape a x b x c
@@ -199,6 +192,13 @@ def calc_scores(labels_targets, labels,
         _ = lambda x: mapper(*x)
         return matrix_map(depth, array, _)
 
+    def mask_buckets(strings, mark: int):
+        strings = np.asarray(strings)
+        return np.where(Embeddings.words().is_bucket(strings), mark, strings)
+
+    def word_name(word: int) -> str:
+        return bucket_marks.get(word) or Embeddings.words().get_name(word)
+
     def matrix_parse(depth, _labels, _tokens, _strings):
         def _(label, tokens, strings) -> Tree:
             raw_tokens = []
@@ -211,7 +211,7 @@ def calc_scores(labels_targets, labels,
                         token = Tokens.PARAM + "[%d]" % MAX_PARAM
                     if token == Types.STRING:
                         string = (word for word in string if word != pad)
-                        token = " ".join(Embeddings.words().get_name(word) for word in string)
+                        token = " ".join(word_name(word) for word in string)
                         token = '"%s"' % token.replace('"', "'")
                     raw_tokens.append(token)
             label = Embeddings.labels().get_name(label)
@@ -254,6 +254,11 @@ def calc_scores(labels_targets, labels,
     nop = Embeddings.tokens().get_index(NOP)
     pad = Embeddings.words().get_index(PAD)
     depth = 2
+    # a bucket stands for several words, so hitting it doesn't prove the right word was predicted,
+    # target and predicted buckets get different marks and never match in any of the scores
+    bucket_marks = {-3: "@target-bucket", -2: "@bucket"}
+    strings_targets = mask_buckets(strings_targets, -3)
+    strings = mask_buckets(strings, -2)
     trees_targets = matrix_parse(depth, labels_targets, tokens_targets, strings_targets)
     trees = matrix_parse(depth, labels, tokens, strings)
     code_targets = matrix_flatten(depth, trees_targets)
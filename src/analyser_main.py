@@ -1,4 +1,5 @@
 import os
+from functools import partial
 from random import Random, randint
 from typing import Iterable, Tuple
 
@@ -11,8 +12,9 @@ from analyser.AnalyserNet import AnalyserNet
 from analyser.Options import Options
 from contants import CONTRACT
 from logger import logger
-from utils import dumpers
+from utils import dumpers, anonymizers
 from utils.Formatter import Formatter
+from utils.ResultsStore import ResultsStore
 from utils.wrappers import trace
 
 
@@ -98,16 +100,51 @@ class Statistic:
 @trace("PREPARE DATA-SET")
 def prepare(options: Options):
     statistic = Statistic()
-    methods = dumpers.json_load(RAW_DATA_SET_PATH)
-    methods = prepares.java_doc(methods)
-    methods = prepares.contract(methods)
+    signatures = set()
+    methods = dumpers.json_iter(RAW_DATA_SET_PATH)
+    methods = prepares.signed(methods, signatures)
+    normalize = partial(prepares.normalize, workers=FLAGS.workers)
+    methods = prepares.cached(methods, CACHE_PATH, normalize, CACHE_CHUNK_SIZE * FLAGS.workers)
+    methods = prepares.tokenize(methods)
     methods = statistic.accountant("number").considers(methods)
-    batches = prepares.batches(methods, options.batch_size, FILLING, options.flatten_type)
+    batches = prepares.batches(
+        methods, options.batch_size, FILLING, options.flatten_type, options.bucketing, options.token_budget)
     data_set = prepares.part(batches, TRAIN_PART, VALIDATION_PART, TEST_PART, Random(SEED))
-    dumpers.pkl_dump(data_set, DATA_SET_PATH)
+    prepares.dump_data_set(data_set, DATA_SET_PATH)
+    dumpers.json_dump(sorted(signatures), SIGNATURES_PATH)
     logger.info("Test set length: %d" % len(data_set.test))
     logger.info("Train set length: %d" % len(data_set.train))
     logger.info("Validation set length: %d" % len(data_set.validation))
+    dumpers.json_print(anonymizers.statistic(), logger.info)
+    dumpers.json_print(prepares.padding_efficiency(batches), logger.info)
+    statistic.show()
+    return batches
+
+
+@trace("UPDATE DATA-SET")
+def update(options: Options):
+    statistic = Statistic()
+    train_path = os.path.join(DATA_SET_PATH, "train")
+    if os.path.isfile(os.path.join(train_path, prepares.INDEX)):
+        # fails before the methods are processed if the words are set up unlike in the prepared data set
+        prepares.load_index(train_path)
+    signatures = set(dumpers.json_load(SIGNATURES_PATH))
+    num_signatures = len(signatures)
+    methods = dumpers.json_iter(RAW_DATA_SET_PATH)
+    methods = prepares.unseen(methods, signatures)
+    normalize = partial(prepares.normalize, workers=FLAGS.workers)
+    methods = prepares.cached(methods, CACHE_PATH, normalize, CACHE_CHUNK_SIZE * FLAGS.workers)
+    methods = prepares.tokenize(methods)
+    methods = statistic.accountant("number").considers(methods)
+    batches = prepares.batches(
+        methods, options.batch_size, FILLING, options.flatten_type, options.bucketing, options.token_budget)
+    Random(SEED).shuffle(batches)
+    prepares.dump_split(batches, train_path)
+    dumpers.json_dump(sorted(signatures), SIGNATURES_PATH)
+    logger.info("New methods: %d" % (len(signatures) - num_signatures))
+    logger.info("Appended train batches: %d" % len(batches))
+    dumpers.json_print(anonymizers.statistic(), logger.info)
+    dumpers.json_print(prepares.padding_efficiency(batches), logger.info)
     statistic.show()
     return batches
 
@@ -138,19 +175,28 @@ def model_dir(options):
     return 'resources/analyser/model-%s' % params
 
 
+def results_store() -> ResultsStore:
+    def legacy_results():
+        return ((sub(result["options"]), result) for result in dumpers.json_load(LEGACY_RESULTS_PATH))
+
+    results = ResultsStore(RESULTS_PATH)
+    if os.path.isfile(LEGACY_RESULTS_PATH):
+        results.populate(legacy_results)
+    return results
+
+
 @trace("RANDOM")
 def random_options(options: Options):
-    results = dumpers.json_load(RESULTS_PATH)
-    used_options = [sub(result["options"]) for result in results]
-    while sub(options.serialize()) in used_options:
-        options.inputs_state_size = randint(5, 15) * 10
-        options.labels_state_size = randint(5, 15) * 10
-        options.tokens_state_size = randint(5, 15) * 10
-        options.strings_state_size = randint(5, 15) * 10
-        # options.inputs_hidden_size = randint(5, 15) * 10
-        # options.labels_hidden_size = randint(5, 15) * 10
-        # options.tokens_hidden_size = randint(5, 15) * 10
-        # options.strings_hidden_size = randint(5, 15) * 10
+    with results_store() as results:
+        while results.contains(sub(options.serialize())):
+            options.inputs_state_size = randint(5, 15) * 10
+            options.labels_state_size = randint(5, 15) * 10
+            options.tokens_state_size = randint(5, 15) * 10
+            options.strings_state_size = randint(5, 15) * 10
+            # options.inputs_hidden_size = randint(5, 15) * 10
+            # options.labels_hidden_size = randint(5, 15) * 10
+            # options.tokens_hidden_size = randint(5, 15) * 10
+            # options.strings_hidden_size = randint(5, 15) * 10
     options.model_dir = model_dir(options)
 
 
@@ -175,22 +221,27 @@ def store(losses, scores, options: Options):
         }
     }
     dumpers.json_print(result, logger.error)
-    results = dumpers.json_load(RESULTS_PATH)
-    results.append(result)
-    dumpers.json_dump(results, RESULTS_PATH)
+    with results_store() as results:
+        results.append(sub(result["options"]), result)
 
 
 flags = tf.app.flags
 flags.DEFINE_bool('prepare', False, '')
+flags.DEFINE_bool('update', False, '')
 flags.DEFINE_bool('random', False, '')
 flags.DEFINE_bool('train', False, '')
 flags.DEFINE_bool('cross', False, '')
 flags.DEFINE_bool('test', False, '')
+flags.DEFINE_integer('workers', 1, '')
 FLAGS = flags.FLAGS
 
-RESULTS_PATH = "resources/analyser/results.json"
+RESULTS_PATH = "resources/analyser/results.sqlite"
+LEGACY_RESULTS_PATH = "resources/analyser/results.json"
 RAW_DATA_SET_PATH = 'resources/data-sets/joda-time.json'
-DATA_SET_PATH = 'resources/analyser/data-set.pickle'
+DATA_SET_PATH = 'resources/analyser/data-set'
+CACHE_PATH = 'resources/analyser/cache'
+SIGNATURES_PATH = 'resources/analyser/signatures.json'
+CACHE_CHUNK_SIZE = 1024
 FILLING = True
 SEED = 58645646
 TRAIN_PART = 0.8
@@ -210,6 +261,9 @@ def main():
         options.label_confidence = 0
         options.token_confidence = 0
         options.string_confidence = 0
+        options.bucketing = False
+        options.prefetch_depth = 2
+        options.correction_type = "greedy"
         options.inputs_state_size = 50
         options.labels_state_size = 50
         options.tokens_state_size = 50
@@ -218,10 +272,14 @@ def main():
         if FLAGS.random:
             random_options(options)
         options.validate()
+        Embeddings.set_words(options.vocabulary_size, options.vocabulary_buckets, options.embeddings_dimension)
         dumpers.json_print(options.serialize(), logger.error)
         if FLAGS.prepare:
             prepare(options)
-        data_set = dumpers.pkl_load(DATA_SET_PATH)
+        elif FLAGS.update:
+            update(options)
+        splits = prepares.DataSet._fields if FLAGS.train else ("test",)
+        data_set = prepares.load_data_set(DATA_SET_PATH, splits)
         net = AnalyserNet(options, data_set)
         if FLAGS.train:
             if FLAGS.cross:
@@ -0,0 +1,269 @@
+import itertools
+from random import Random
+
+import numpy as np
+from contracts import Tokens, Types
+from contracts.BfsGuide import BfsGuide
+from contracts.Node import Node
+from contracts.Token import Token
+from contracts.Tree import Tree
+
+import prepares
+from analyser import Embeddings, misc
+from contants import UNDEFINED, PAD, NOP
+from utils import anonymizers
+from utils.Formatter import Formatter
+from utils.wrappers import Timer
+
+
+def html_table(depth: int, width: int) -> str:
+    if depth == 0:
+        return "cell value %d" % width
+    rows = ("<tr><td>%s</td><td>text</td></tr>" % html_table(depth - 1, width) for _ in range(width))
+    return "<table>%s</table>" % "".join(rows)
+
+
+def html_heavy_doc(size: int) -> str:
+    parts = ("Returns the <b>field</b> value.<p>%s</p>" % html_table(2, 4) for _ in range(size))
+    return " ".join(parts)
+
+
+def nested_html_doc(size: int) -> str:
+    return "Nested <em>blocks</em>: " + "<div> text " * size + "value" + " text </div>" * size
+
+
+def measure(function, argument, repeats: int) -> float:
+    with Timer(printer=None) as timer:
+        for _ in range(repeats):
+            function(argument)
+    return timer.delay() / repeats
+
+
+def anonymize_tags_worst_case(sizes=(10, 20, 40, 80, 160, 320), repeats=5):
+    heads = ("doc", "size", "length", "time, ms", "ms per 1k chars")
+    formatter = Formatter(heads, ("s", "d", "d", ".3f", ".4f"), (15, 15, 15, 15, 20))
+    formatter.print_head()
+    for name, generator in (("tables", html_heavy_doc), ("nested", lambda size: nested_html_doc(size * 50))):
+        for size in sizes:
+            doc = generator(size)
+            delay = measure(anonymizers.anonymize_tags, doc, repeats) * 1000
+            formatter.print(name, size, len(doc), delay, delay * 1000 / len(doc))
+    formatter.print_lower_delimiter()
+
+
+def adversarial_docs(length: int) -> dict:
+    units = ("a", "1", "1.", "1,1.", "+1", "a.", "a.b", "ab@", "a.c@", "/a", "/a.\\ ", "a:", "a://", "<a>", "</a>", "&amp;")
+    return {unit: " %s " % (unit * (length // len(unit))) for unit in units}
+
+
+def garbage_docs(count: int, length: int, random: Random) -> list:
+    alphabet = "aZ1_.,:;/\\?=-+@<>&{}() \t\u00e9"
+    return ["".join(random.choice(alphabet) for _ in range(random.randint(1, length))) for _ in range(count)]
+
+
+def regex_worst_case(lengths=(1000, 10000, 100000), fuzz_count=2000, fuzz_length=2000, seconds_per_char=2e-5):
+    functions = (
+        anonymizers.anonymize_numbers,
+        anonymizers.anonymize_paths,
+        anonymizers.anonymize_URLs,
+        anonymizers.anonymize_tags,
+        anonymizers.apply)
+    bound = lambda doc: 0.01 + seconds_per_char * len(doc)
+    heads = ("function", "doc", "length", "time, ms", "bound, ms")
+    formatter = Formatter(heads, ("s", "s", "d", ".3f", ".3f"), (25, 10, 10, 12, 12))
+    formatter.print_head()
+    for length in lengths:
+        for unit, doc in adversarial_docs(length).items():
+            for function in functions:
+                delay = measure(function, doc, 1)
+                formatter.print(function.__name__, repr(unit), len(doc), delay * 1000, bound(doc) * 1000)
+                assert delay < bound(doc), "%s took %.3fs on %r * %d" % (function.__name__, delay, unit, length)
+    slowest = {}
+    for doc in garbage_docs(fuzz_count, fuzz_length, Random(0)):
+        for function in functions:
+            delay = measure(function, doc, 1)
+            assert delay < bound(doc), "%s took %.3fs on %r" % (function.__name__, delay, doc)
+            slowest[function.__name__] = max(slowest.get(function.__name__, 0), delay)
+    for name, delay in slowest.items():
+        formatter.print(name, "fuzz", fuzz_length, delay * 1000, bound(" " * fuzz_length) * 1000)
+    formatter.print_lower_delimiter()
+
+
+def loop_build_targets(contracts, labels_length: int, tokens_length: int, strings_length: int):
+    # build_targets before vectorization, kept as the reference
+    undefined = Embeddings.labels().get_index(UNDEFINED)
+    pad = Embeddings.words().get_index(PAD)
+    nop = Embeddings.tokens().get_index(NOP)
+    labels_targets, tokens_targets, strings_targets = [], [], []
+    for contract in contracts:
+        strings = np.tile(-1, [labels_length, tokens_length, strings_length])
+        tokens = np.tile(nop, [labels_length, tokens_length])
+        labels = np.tile(undefined, [labels_length])
+        for i, (raw_label, raw_tokens, raw_strings) in enumerate(contract):
+            labels[i] = Embeddings.labels().get_index(raw_label)
+            raw_tokens = [Embeddings.tokens().get_index(token) for token in raw_tokens]
+            tokens[i][:len(raw_tokens)] = raw_tokens
+            for idx, raw_string in raw_strings.items():
+                raw_string = [Embeddings.words().get_index(word) for word in raw_string]
+                strings[i][idx][:len(raw_string)] = raw_string
+                strings[i][idx][len(raw_string):] = [pad] * (strings_length - len(raw_string))
+        labels_targets.append(labels)
+        tokens_targets.append(tokens)
+        strings_targets.append(strings)
+    return np.asarray(labels_targets), np.asarray(tokens_targets), np.asarray(strings_targets)
+
+
+def random_contracts(batch_size: int, labels_length: int, tokens_length: int, strings_length: int, random: Random):
+    labels = Embeddings.labels().idx2name
+    tokens = Embeddings.tokens().idx2name
+    words = Embeddings.words().idx2name[:1000] + ["unknown-%d" % i for i in range(10)]
+    contracts = []
+    for _ in range(batch_size):
+        contract = []
+        for _ in range(random.randint(1, labels_length)):
+            raw_tokens = [random.choice(tokens) for _ in range(random.randint(1, tokens_length))]
+            indices = random.sample(range(len(raw_tokens)), random.randint(0, len(raw_tokens)))
+            raw_strings = {j: [random.choice(words) for _ in range(random.randint(0, strings_length - 1))]
+                           for j in indices}
+            contract.append((random.choice(labels), raw_tokens, raw_strings))
+        contracts.append(contract)
+    return contracts
+
+
+def build_targets_speed(shapes=((4, 3, 7, 5), (16, 3, 15, 8), (64, 4, 31, 10)), repeats=10):
+    heads = ("batch size", "labels", "tokens", "strings", "loop, ms", "vectorized, ms", "speedup")
+    formatter = Formatter(heads, ("d", "d", "d", "d", ".3f", ".3f", ".2f"), (12, 10, 10, 10, 12, 16, 10))
+    formatter.print_head()
+    for shape in shapes:
+        contracts = random_contracts(*shape, Random(0))
+        lengths = shape[1:]
+        expected = loop_build_targets(contracts, *lengths)
+        labels, tokens, strings = prepares.build_targets(contracts, *lengths)
+        for expected_array, actual_array in zip(expected, (labels, tokens)):
+            assert expected_array.dtype == actual_array.dtype
+            assert np.array_equal(expected_array, actual_array)
+        assert np.array_equal(expected[2], prepares.densify(strings))
+        loop = measure(lambda arguments: loop_build_targets(*arguments), (contracts, *lengths), repeats)
+        vectorized = measure(lambda arguments: prepares.build_targets(*arguments), (contracts, *lengths), repeats)
+        formatter.print(*shape, loop * 1000, vectorized * 1000, loop / vectorized)
+    formatter.print_lower_delimiter()
+
+
+def equalized_slots(tree: Tree, height: int):
+    # convert_to with filling and bfs flattening before bfs_slots, kept as the reference
+    tree = prepares.Equalizer(height).accept(tree.clone())
+    return [prepares.Compiler(BfsGuide()).accept(Tree(child)) for child in tree.root.children]
+
+
+def random_expression(height: int, random: Random) -> Node:
+    if height == 1 or random.random() < 0.25:
+        kind = random.randrange(3)
+        if kind == 0:
+            return Node(Token(Tokens.PARAM + "[%d]" % random.randint(0, prepares.MAX_PARAM + 2), Types.MARKER))
+        if kind == 1:
+            return Node(Token(random.choice((Tokens.TRUE, Tokens.FALSE)), Types.OPERATOR))
+        words = (random.choice(("a", "b", "null", "value")) for _ in range(random.randint(0, 3)))
+        return Node(Token('"%s"' % " ".join(words), Types.STRING))
+    token = Token(random.choice(Tokens.instances[Types.OPERATOR]), Types.OPERATOR)
+    return Node(token, random_expression(height - 1, random), random_expression(height - 1, random))
+
+
+def random_contract(height: int, random: Random) -> Tree:
+    labels = (Token(random.choice(Tokens.instances[Types.LABEL]), Types.LABEL) for _ in range(random.randint(1, 3)))
+    children = (Node(label, random_expression(height - 2, random)) for label in labels)
+    return Tree(Node(Token(Tokens.ROOT, Types.ROOT), *children))
+
+
+def bfs_slots_speed(heights=(3, 5, 7, 9), count=200, repeats=3):
+    heads = ("height", "equalized, ms", "bfs slots, ms", "speedup")
+    formatter = Formatter(heads, ("d", ".3f", ".3f", ".2f"), (10, 15, 15, 10))
+    formatter.print_head()
+    random = Random(0)
+    for height in heights:
+        trees = [random_contract(height, random) for _ in range(count)]
+        # build_batch flattens every contract to the height of the highest one
+        height = max(tree.height() for tree in trees)
+        for tree in trees:
+            assert prepares.bfs_slots(tree, height) == equalized_slots(tree, height)
+        equalized = measure(lambda trees: [equalized_slots(tree, height) for tree in trees], trees, repeats)
+        slots = measure(lambda trees: [prepares.bfs_slots(tree, height) for tree in trees], trees, repeats)
+        formatter.print(height, equalized * 1000, slots * 1000, equalized / slots)
+    formatter.print_lower_delimiter()
+
+
+def loop_greedy_correct(targets, outputs):
+    # greedy_correct before vectorization, kept as the reference, returns permutations[b, to] = from
+    permutations = []
+    for b in range(len(outputs[0])):
+        length = len(outputs[0][b])
+        permutation = [None] * length
+        from_indexes = list(range(length))
+        to_indexes = list(range(length))
+        for _ in range(length):
+            index_best_from_index = None
+            index_best_to_index = None
+            best_distance = None
+            for i, from_index in enumerate(from_indexes):
+                for j, to_index in enumerate(to_indexes):
+                    distance = 0
+                    for target, output in zip(targets, outputs):
+                        distance += np.linalg.norm(target[b][from_index] - output[b][to_index])
+                    if best_distance is None or distance < best_distance:
+                        index_best_from_index = i
+                        index_best_to_index = j
+                        best_distance = distance
+            permutation[to_indexes[index_best_to_index]] = from_indexes[index_best_from_index]
+            del from_indexes[index_best_from_index]
+            del to_indexes[index_best_to_index]
+        permutations.append(permutation)
+    return np.asarray(permutations)
+
+
+def random_outputs(batch_size: int, length: int, shapes, random: np.random.RandomState):
+    targets = [random.rand(batch_size, length, *shape) for shape in shapes]
+    outputs = [random.rand(batch_size, length, *shape) for shape in shapes]
+    return targets, outputs
+
+
+def assignment_cost(costs, permutations) -> float:
+    rows = np.arange(len(permutations))[:, np.newaxis]
+    return float(np.sum(costs[rows, permutations, np.arange(permutations.shape[1])]))
+
+
+def brute_force_cost(costs) -> float:
+    columns = np.arange(costs.shape[1])
+    permutations = [list(permutation) for permutation in itertools.permutations(columns)]
+    return float(sum(min(np.sum(cost[permutation, columns]) for permutation in permutations) for cost in costs))
+
+
+def correct_speed(lengths=(3, 5, 8), batch_size=4, shapes=((20,), (7, 20), (7, 5, 50)), repeats=3):
+    heads = ("length", "loop, ms", "greedy, ms", "hungarian, ms", "speedup", "optimal gain")
+    formatter = Formatter(heads, ("d", ".3f", ".3f", ".3f", ".2f", ".4f"), (10, 12, 12, 15, 10, 15))
+    formatter.print_head()
+    random = np.random.RandomState(0)
+    for length in lengths:
+        targets, outputs = random_outputs(batch_size, length, shapes, random)
+        costs = misc.distances(targets, outputs)
+        expected = loop_greedy_correct(targets, outputs)
+        greedy = misc.greedy_assignment(costs)
+        hungarian = misc.hungarian_assignment(costs)
+        assert np.array_equal(expected, greedy)
+        if length <= 6:
+            assert np.isclose(assignment_cost(costs, hungarian), brute_force_cost(costs))
+        assert assignment_cost(costs, hungarian) <= assignment_cost(costs, greedy) + 1e-9
+        loop = measure(lambda arguments: loop_greedy_correct(*arguments), (targets, outputs), repeats)
+        vectorized = measure(lambda arguments: misc.greedy_assignment(misc.distances(*arguments)),
+                             (targets, outputs), repeats)
+        optimal = measure(lambda arguments: misc.hungarian_assignment(misc.distances(*arguments)),
+                          (targets, outputs), repeats)
+        gain = assignment_cost(costs, greedy) - assignment_cost(costs, hungarian)
+        formatter.print(length, loop * 1000, vectorized * 1000, optimal * 1000, loop / vectorized, gain)
+    formatter.print_lower_delimiter()
+
+
+if __name__ == '__main__':
+    anonymize_tags_worst_case()
+    regex_worst_case()
+    build_targets_speed()
+    bfs_slots_speed()
+    correct_speed()
@@ -34,7 +34,12 @@ TAGS = PARTS + (STRING, NUMBER, HTML_BEGIN, HTML_END, HTML_BLOCK, LINK, PATH, UR
 
 CONTRACT = "contract"
 JAVA_DOC = "java-doc"
+JAVA_DOC_IDS = "java-doc-ids"
 DESCRIPTION = "description"
 FLAT = "flat"
+CACHE_KEY = "cache-key"
 
 EMBEDDINGS_PATH = 'resources/word2vec/embeddings.pickle'
+EMBEDDINGS_VOCABULARY_PATH = 'resources/word2vec/embeddings.vocab'
+EMBEDDINGS_MATRIX_PATH = 'resources/word2vec/embeddings.npy'
+EMBEDDINGS_REDUCED_MATRIX_PATH = 'resources/word2vec/embeddings-%d.npy'
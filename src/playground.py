@@ -1,35 +1,10 @@
 from contants import JAVA_DOC, CONTRACT, DESCRIPTION
 from utils import dumpers
+from utils.representers import hash_repr
 
 HASH = "hash"
 
 
-def hash_repr(method):
-    description = method[DESCRIPTION]
-    name = description["name"]
-    owner = description["owner"]
-    result = type_repr(description["type"])
-    parameters = description["parameters"]
-    parameters = [(parameter["name"], type_repr(parameter["type"])) for parameter in parameters]
-    parameters = ", ".join("%s: %s" % parameter for parameter in parameters)
-    description = "%s %s : %s(%s) %s" % (DESCRIPTION, owner, name, parameters, result)
-    return description
-
-
-def type_repr(string):
-    if string == 'B': return "byte"
-    if string == 'C': return "char"
-    if string == 'D': return "double"
-    if string == 'F': return "float"
-    if string == 'I': return "int"
-    if string == 'J': return "long"
-    if string == 'S': return "short"
-    if string == 'Z': return "boolean"
-    if string == 'V': return "void"
-    if string == "void*": return "void"
-    return string.split("<")[0]
-
-
 def convert():
     methods_v1 = dumpers.json_load("resources/data-sets/joda-time-v1.json")
     methods_v2 = dumpers.json_load("resources/data-sets/joda-time-v2.json")
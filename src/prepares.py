@@ -1,5 +1,11 @@
+import hashlib
+import json
+import os
 import re
-from collections import namedtuple
+import shutil
+from collections import namedtuple, deque
+from functools import partial
+from multiprocessing.pool import Pool
 from random import Random
 from typing import Iterable, List, Any, Dict, Tuple
 
@@ -14,11 +20,14 @@ from contracts.TreeVisitor import TreeVisitor, TreeGuide
 from contracts.Validator import is_param, Validator
 
 from analyser import Embeddings
-from contants import PAD, NOP, NEXT, PARTS, SIGNATURE, PARAMETER, CONTRACT, JAVA_DOC, DESCRIPTION, UNDEFINED
-from utils import anonymizers
-from utils.wrappers import static
+from contants import PAD, NOP, NEXT, PARTS, SIGNATURE, PARAMETER, CONTRACT, JAVA_DOC, DESCRIPTION, UNDEFINED, \
+    CACHE_KEY, JAVA_DOC_IDS
+from utils import anonymizers, dumpers
+from utils.representers import hash_repr
+from utils.wrappers import static, memoize
 
 MAX_PARAM = 5
+PIPELINE_VERSION = 1
 
 
 def convert(token: Token) -> Token:
@@ -100,8 +109,45 @@ class Compiler(TreeVisitor):
             self.tokens.append(token.name)
 
 
+def bfs_slots(tree: Tree, height: int) -> List[Tuple[str, List[str], Dict[int, List[str]]]]:
+    # the slots Compiler(BfsGuide()) gives to the tree completed by Equalizer: it's a heap, so children of slot
+    # k take slots 2k+1 and 2k+2, real nodes are written over NOP and the padding subtrees are never built
+    size = 2 ** (height - 2) - 1
+    result = []
+    for child in tree.root.children:
+        label = UNDEFINED
+        roots = [child]
+        if child.token.type == Types.LABEL:
+            label = child.token.name
+            roots = child.children
+        # the heap layout is the equalized one only for a single expression of binary operators under a label
+        if len(roots) > 1:
+            raise ValueError("Label '%s' with %d expressions hasn't supported by bfs slots" % (label, len(roots)))
+        tokens = [NOP] * size
+        strings = {}
+        stack = [(root, slot) for slot, root in enumerate(roots)]
+        while len(stack) > 0:
+            node, slot = stack.pop()
+            token = convert(node.token)
+            if token is None:
+                continue
+            if len(node.children) not in (0, 2):
+                raise ValueError("Token '%s' with %d children hasn't supported by bfs slots"
+                                 % (node.token.name, len(node.children)))
+            if slot >= size:
+                raise ValueError("Token '%s' is deeper than height %d" % (node.token.name, height))
+            if token.type == Types.STRING:
+                strings[slot] = node.token.name[1:-1].split()
+            tokens[slot] = token.name
+            stack.extend((node_child, 2 * slot + 1 + i) for i, node_child in enumerate(node.children))
+        result.append((label, tokens, strings))
+    return result
+
+
 def convert_to(tree: Tree, height: int, filling: bool, flatten_type: str):
     Validator().accept(tree)
+    if filling and flatten_type == "bfs":
+        return bfs_slots(tree, height)
     if filling:
         equalizer = Equalizer(height)
         tree = equalizer.accept(tree)
@@ -151,10 +197,13 @@ def append_signature(method):
     return method
 
 
-def apply_anonymizers(method):
-    java_doc = {label: anonymizers.apply(text) for label, text in method[JAVA_DOC].items()}
-    method[JAVA_DOC] = java_doc
-    return method
+def apply_anonymizers(methods, chunk_size: int = 256) -> Iterable[dict]:
+    for chunk in chunks(methods, chunk_size):
+        texts = (text for method in chunk for text in method[JAVA_DOC].values())
+        texts = iter(anonymizers.apply_many(texts))
+        for method in chunk:
+            method[JAVA_DOC] = {label: next(texts) for label in method[JAVA_DOC]}
+            yield method
 
 
 def one_line_doc(method):
@@ -164,6 +213,12 @@ def one_line_doc(method):
     return method
 
 
+def tokenize(methods) -> Iterable[dict]:
+    for method in methods:
+        method[JAVA_DOC_IDS] = Embeddings.words().get_indices(method[JAVA_DOC].split())
+        yield method
+
+
 class Mapper(TreeVisitor):
     def __init__(self, map_function):
         super().__init__(DfsGuide())
@@ -234,18 +289,58 @@ def standardify_contract(method):
     return method
 
 
-def batching(methods: Iterable[dict], batch_size: int):
-    def chunks(iterable: Iterable[Any], block_size: int):
-        result = []
-        for element in iterable:
-            result.append(element)
-            if len(result) == block_size:
-                yield result
-                result = []
-        if len(result) > 0:
+def chunks(iterable: Iterable[Any], block_size: int) -> Iterable[List[Any]]:
+    result = []
+    for element in iterable:
+        result.append(element)
+        if len(result) == block_size:
             yield result
+            result = []
+    if len(result) > 0:
+        yield result
+
+
+def batching(methods: Iterable[dict], batch_size: int):
+    # the trailing chunk may be shorter, build_batch fills it up with dummy rows
+    return chunks(methods, batch_size)
+
+
+def decoder_shape(method) -> Tuple[int, int, int]:
+    class Measurer(TreeVisitor):
+        def __init__(self):
+            super().__init__(DfsGuide())
+            self.length = 0
+
+        def visit_string(self, depth: int, node: Node, parent: Node):
+            self.length = max(self.length, len(node.token.name[1:-1].split()))
 
-    return (chunk for chunk in chunks(methods, batch_size) if len(chunk) == batch_size)
+    tree = method[CONTRACT]
+    measurer = Measurer()
+    measurer.accept(tree)
+    return len(tree.root.children), 2 ** (tree.height() - 2) - 1, measurer.length + 1
+
+
+def budgeting(methods: Iterable[dict], budget: int):
+    # packs methods while the padded decoder cells (labels x tokens x strings) of the batch fit the budget
+    batch = []
+    labels_length, tokens_length, strings_length = 0, 0, 0
+    for method in methods:
+        labels, tokens, strings = decoder_shape(method)
+        labels, tokens, strings = max(labels, labels_length), max(tokens, tokens_length), max(strings, strings_length)
+        if len(batch) > 0 and (len(batch) + 1) * labels * tokens * strings > budget:
+            yield batch
+            batch = []
+            labels, tokens, strings = decoder_shape(method)
+        batch.append(method)
+        labels_length, tokens_length, strings_length = labels, tokens, strings
+    if len(batch) > 0:
+        yield batch
+
+
+def bucketing(methods: Iterable[dict], batch_size: int, budget: int = None):
+    # tokens grow as 2 ** height, so methods of one height and close doc lengths are padded together
+    methods = sorted(methods, key=lambda method: (method[CONTRACT].height(), len(method[JAVA_DOC_IDS])))
+    return batching(methods, batch_size) if budget is None else budgeting(methods, budget)
 
 
 def filter_contract_text(method):
@@ -256,7 +351,7 @@ def filter_contract_text(method):
         def visit_string_end(self, depth: int, node: Node, parent: Node):
             name = node.token.name
             quote = name[0]
-            name = anonymizers.apply(name[1:-1])
+            name = anonymizers.memoized_apply(name[1:-1])
             name = quote + name + quote
             node.token = Token(name, node.token.type)
 
@@ -274,20 +369,74 @@ def parse_contract(method):
     return method
 
 
-def build_batch(methods: List[dict], filling, flatten_type):
+def append_rows(array: np.ndarray, number: int, value) -> np.ndarray:
+    rows = np.full([number, *array.shape[1:]], value, array.dtype)
+    return np.concatenate([array, rows])
+
+
+SparseStrings = namedtuple("SparseStrings", ("shape", "indices", "values"))
+
+
+def densify(strings) -> np.ndarray:
+    if not isinstance(strings, SparseStrings):
+        return strings
+    array = np.full(strings.shape, -1, np.int32)
+    array.flat[strings.indices] = strings.values
+    return array
+
+
+def build_targets(contracts, labels_length: int, tokens_length: int, strings_length: int):
     undefined = Embeddings.labels().get_index(UNDEFINED)
     pad = Embeddings.words().get_index(PAD)
     nop = Embeddings.tokens().get_index(NOP)
 
-    inputs = (method[JAVA_DOC] for method in methods)
-    inputs = ((word.strip() for word in input.split(" ")) for input in inputs)
-    inputs = ((word for word in input if len(word) > 0) for input in inputs)
-    inputs = [[Embeddings.words().get_index(word) for word in input] for input in inputs]
-    inputs_length = [len(input) for input in inputs]
+    # names and ragged lengths are collected once, then looked up and scattered in one call per target
+    labels_slots, strings_slots, tokens_counts, words_counts = [], [], [], []
+    raw_labels, raw_tokens, raw_words = [], [], []
+    for b, contract in enumerate(contracts):
+        for i, (raw_label, tokens, strings) in enumerate(contract):
+            labels_slots.append((b, i))
+            raw_labels.append(raw_label)
+            tokens_counts.append(len(tokens))
+            raw_tokens.extend(tokens)
+            for j, string in strings.items():
+                strings_slots.append((b, i, j))
+                words_counts.append(len(string))
+                raw_words.extend(string)
+
+    def expand(slots: np.ndarray, counts: List[int]) -> tuple:
+        # every slot followed by 0..count-1 along the next axis
+        counts = np.asarray(counts, np.int64)
+        starts = np.repeat(np.cumsum(counts) - counts, counts)
+        return (*np.repeat(slots, counts, 0).T, np.arange(len(starts)) - starts)
+
+    labels_slots = np.asarray(labels_slots, np.int64).reshape([-1, 2])
+    strings_slots = np.asarray(strings_slots, np.int64).reshape([-1, 3])
+    labels_targets = np.full([len(contracts), labels_length], undefined)
+    tokens_targets = np.full([len(contracts), labels_length, tokens_length], nop)
+    labels_targets[tuple(labels_slots.T)] = Embeddings.labels().get_indices(raw_labels)
+    tokens_targets[expand(labels_slots, tokens_counts)] = Embeddings.tokens().get_indices(raw_tokens)
+
+    # every string slot owns strings_length cells: its words followed by pads, other cells stay -1
+    shape = (len(contracts), labels_length, tokens_length, strings_length)
+    cells = np.ravel_multi_index(tuple(strings_slots.T), shape[:3]) * strings_length
+    indices = (cells[:, np.newaxis] + np.arange(strings_length)).ravel()
+    values = np.full(len(indices), pad, np.int32)
+    offsets, words = expand(np.arange(len(strings_slots))[:, np.newaxis] * strings_length, words_counts)
+    values[offsets + words] = Embeddings.words().get_indices(raw_words)
+    strings_targets = SparseStrings(shape, indices, values)
+    return labels_targets, tokens_targets, strings_targets
+
+
+def build_batch(methods: List[dict], filling, flatten_type, batch_size: int = None):
+    pad = Embeddings.words().get_index(PAD)
+
+    docs = [method[JAVA_DOC_IDS] for method in methods]
+    inputs_length = np.asarray([len(doc) for doc in docs])
     inputs_steps = max(inputs_length)
-    inputs = [input + [pad] * (inputs_steps + 1 - len(input)) for input in inputs]
-    inputs = np.asarray(inputs)
-    inputs_length = np.asarray(inputs_length)
+    inputs = np.full([len(docs), inputs_steps + 1], pad, np.int32)
+    for input, doc in zip(inputs, docs):
+        input[:len(doc)] = doc
 
     contracts = [method[CONTRACT] for method in methods]
     height = max(contract.height() for contract in contracts)
@@ -303,25 +452,17 @@ def build_batch(methods: List[dict], filling, flatten_type):
         for string in strings.values())
     strings_length = max(strings_lengths, default=0) + 1
 
-    labels_targets, tokens_targets, strings_targets = [], [], []
-    for contract in contracts:
-        strings = np.tile(-1, [labels_length, tokens_length, strings_length])
-        tokens = np.tile(nop, [labels_length, tokens_length])
-        labels = np.tile(undefined, [labels_length])
-        for i, (raw_label, raw_tokens, raw_strings) in enumerate(contract):
-            labels[i] = Embeddings.labels().get_index(raw_label)
-            raw_tokens = [Embeddings.tokens().get_index(token) for token in raw_tokens]
-            tokens[i][:len(raw_tokens)] = raw_tokens
-            for idx, raw_string in raw_strings.items():
-                raw_string = [Embeddings.words().get_index(word) for word in raw_string]
-                strings[i][idx][:len(raw_string)] = raw_string
-                strings[i][idx][len(raw_string):] = [pad] * (strings_length - len(raw_string))
-        labels_targets.append(labels)
-        tokens_targets.append(tokens)
-        strings_targets.append(strings)
-    labels_targets = np.asarray(labels_targets)
-    tokens_targets = np.asarray(tokens_targets)
-    strings_targets = np.asarray(strings_targets)
+    targets = build_targets(contracts, labels_length, tokens_length, strings_length)
+    labels_targets, tokens_targets, strings_targets = targets
+
+    # dummy rows have zero inputs length and -1 targets, losses and scores skip them
+    dummies = 0 if batch_size is None else batch_size - len(methods)
+    if dummies > 0:
+        inputs = append_rows(inputs, dummies, pad)
+        inputs_length = append_rows(inputs_length, dummies, 0)
+        labels_targets = append_rows(labels_targets, dummies, -1)
+        tokens_targets = append_rows(tokens_targets, dummies, -1)
+        strings_targets = strings_targets._replace(shape=(batch_size, *strings_targets.shape[1:]))
 
     labels = labels_targets, labels_length
     tokens = tokens_targets, tokens_length
@@ -329,18 +470,41 @@ def build_batch(methods: List[dict], filling, flatten_type):
     return (inputs, inputs_length), labels, tokens, strings
 
 
-def java_doc(methods) -> Iterable[dict]:
+@memoize.function
+def pool(workers: int) -> Pool:
+    return Pool(workers)
+
+
+def apply_stage(stage, methods: List[dict]) -> List[dict]:
+    return list(stage(methods))
+
+
+def in_pool(stage, methods, workers: int, chunk_size: int) -> Iterable[dict]:
+    pending = deque()
+    for chunk in chunks(methods, chunk_size):
+        pending.append(pool(workers).apply_async(partial(apply_stage, stage), (chunk,)))
+        if len(pending) >= 2 * workers:
+            yield from pending.popleft().get()
+    while len(pending) > 0:
+        yield from pending.popleft().get()
+
+
+def java_doc(methods, workers: int = 1, chunk_size: int = 256) -> Iterable[dict]:
+    if workers > 1:
+        return in_pool(java_doc, methods, workers, chunk_size)
     methods = (method for method in methods if not is_empty(method))
     methods = (append_param_delimiter(method) for method in methods)
     methods = (append_signature(method) for method in methods)
     methods = (join_java_doc(method) for method in methods)
-    methods = (apply_anonymizers(method) for method in methods)
+    methods = apply_anonymizers(methods)
     methods = (method for method in methods if not is_empty(method))
     methods = (one_line_doc(method) for method in methods)
     return methods
 
 
-def contract(methods) -> Iterable[dict]:
+def contract(methods, workers: int = 1, chunk_size: int = 256) -> Iterable[dict]:
+    if workers > 1:
+        return in_pool(contract, methods, workers, chunk_size)
     methods = (parse_contract(method) for method in methods)
     methods = (method for method in methods if method[CONTRACT].height() > 1)
     methods = (standardify_contract(method) for method in methods)
@@ -348,12 +512,98 @@ def contract(methods) -> Iterable[dict]:
     return methods
 
 
-def batches(methods, batch_size, filling, flatten_type) -> list:
-    batches = batching(methods, batch_size)
-    batches = [build_batch(method, filling, flatten_type) for method in batches]
+def normalize(methods, workers: int = 1, chunk_size: int = 256) -> Iterable[dict]:
+    if workers > 1:
+        return in_pool(normalize, methods, workers, chunk_size)
+    return contract(java_doc(methods))
+
+
+def method_key(method) -> str:
+    raw = json.dumps(method, sort_keys=True)
+    raw = "%d:%s" % (PIPELINE_VERSION, raw)
+    return hashlib.sha1(raw.encode("utf8")).hexdigest()
+
+
+def cached(methods, path: str, pipeline=normalize, chunk_size: int = 1024) -> Iterable[dict]:
+    def entry_path(key: str) -> str:
+        return os.path.join(path, key[:2], key + ".pickle")
+
+    def store(key: str, entry):
+        directory = os.path.dirname(entry_path(key))
+        if not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        temp_path = "%s.%d.tmp" % (entry_path(key), os.getpid())
+        dumpers.pkl_dump(entry, temp_path)
+        os.replace(temp_path, entry_path(key))
+
+    for chunk in chunks(methods, chunk_size):
+        keys = [method_key(method) for method in chunk]
+        entries = {}
+        misses = {}
+        for key, method in zip(keys, chunk):
+            if key in entries or key in misses:
+                continue
+            if os.path.isfile(entry_path(key)):
+                entries[key] = dumpers.pkl_load(entry_path(key))
+            else:
+                method[CACHE_KEY] = key
+                misses[key] = method
+        for key in misses:
+            entries[key] = None
+        for method in pipeline(misses.values()):
+            entries[method.pop(CACHE_KEY)] = (method[JAVA_DOC], method[CONTRACT])
+        for key in misses:
+            store(key, entries[key])
+        for key, method in zip(keys, chunk):
+            method.pop(CACHE_KEY, None)
+            if entries[key] is not None:
+                method[JAVA_DOC], method[CONTRACT] = entries[key]
+                yield method
+
+
+def signed(methods, signatures: set) -> Iterable[dict]:
+    for method in methods:
+        signatures.add(hash_repr(method))
+        yield method
+
+
+def unseen(methods, signatures: set) -> Iterable[dict]:
+    for method in methods:
+        signature = hash_repr(method)
+        if signature not in signatures:
+            signatures.add(signature)
+            yield method
+
+
+def batches(methods, batch_size, filling, flatten_type, bucketed: bool = False, budget: int = None) -> list:
+    if bucketed:
+        batches = bucketing(methods, batch_size, budget)
+    elif budget is not None:
+        batches = budgeting(methods, budget)
+    else:
+        batches = batching(methods, batch_size)
+    batch_size = None if budget is not None else batch_size
+    batches = [build_batch(chunk, filling, flatten_type, batch_size) for chunk in batches]
     return batches
 
 
+def padding_efficiency(batches) -> dict:
+    undefined = Embeddings.labels().get_index(UNDEFINED)
+    pad = Embeddings.words().get_index(PAD)
+    nop = Embeddings.tokens().get_index(NOP)
+    used = dict.fromkeys(("inputs", "labels", "tokens", "strings"), 0)
+    total = dict.fromkeys(used, 0)
+    for (inputs, inputs_length), (labels, _), (tokens, _), (strings, _) in batches:
+        used["inputs"] += int(np.sum(inputs_length))
+        used["labels"] += int(np.count_nonzero((labels != -1) & (labels != undefined)))
+        used["tokens"] += int(np.count_nonzero((tokens != -1) & (tokens != nop)))
+        used["strings"] += int(np.count_nonzero(strings.values != pad))
+        for name, array in zip(used, (inputs, labels, tokens)):
+            total[name] += int(np.size(array))
+        total["strings"] += int(np.prod(strings.shape))
+    return {name: used[name] / total[name] if total[name] > 0 else 0.0 for name in used}
+
+
 DataSet = namedtuple("DataSet", ("train", "validation", "test"))
 
 
@@ -372,3 +622,99 @@ def part(batches, train, validation, test, random: Random) -> DataSet:
     batches = batches[:-train_set_length]
     validation_set = batches[-validation_set_length:]
     return DataSet(train_set, validation_set, test_set)
+
+
+FAMILIES = ("inputs", "inputs_length", "labels", "tokens", "strings_indices", "strings_values")
+INDEX = "index.json"
+STORAGE_VERSION = 3
+
+
+def flatten_batch(batch) -> Tuple[tuple, tuple, tuple]:
+    (inputs, inputs_length), labels, tokens, strings = batch
+    labels_targets, labels_length = labels
+    tokens_targets, tokens_length = tokens
+    strings_targets, strings_length = strings
+    arrays = (inputs, inputs_length, labels_targets, tokens_targets, strings_targets.indices, strings_targets.values)
+    lengths = (labels_length, tokens_length, strings_length)
+    return arrays, lengths, strings_targets.shape
+
+
+def unflatten_batch(arrays, lengths, strings_shape) -> tuple:
+    inputs, inputs_length, labels_targets, tokens_targets, strings_indices, strings_values = arrays
+    labels_length, tokens_length, strings_length = lengths
+    strings_targets = SparseStrings(tuple(strings_shape), strings_indices, strings_values)
+    labels = labels_targets, labels_length
+    tokens = tokens_targets, tokens_length
+    strings = strings_targets, strings_length
+    return (inputs, inputs_length), labels, tokens, strings
+
+
+def dump_split(batches: list, path: str):
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    index_path = os.path.join(path, INDEX)
+    index = load_index(path) if os.path.isfile(index_path) else {
+        "version": STORAGE_VERSION, "words": Embeddings.words_options(), "shards": 0, "batches": []}
+    if len(batches) == 0:
+        dumpers.json_dump(index, index_path)
+        return
+    shard = index["shards"]
+    batches = [flatten_batch(batch) for batch in batches]
+    records = [
+        {"shard": shard, "lengths": [int(length) for length in lengths], "strings": [int(size) for size in shape]}
+        for _, lengths, shape in batches]
+    for i, family in enumerate(FAMILIES):
+        arrays = [np.asarray(arrays[i]) for arrays, _, _ in batches]
+        offsets = dumpers.npy_dump(arrays, os.path.join(path, "%s-%d.npy" % (family, shard)))
+        for record, array, offset in zip(records, arrays, offsets):
+            record[family] = [offset, list(array.shape)]
+    index["shards"] = shard + 1
+    index["batches"].extend(records)
+    dumpers.json_dump(index, index_path)
+
+
+def load_index(path: str) -> dict:
+    index = dumpers.json_load(os.path.join(path, INDEX))
+    if index.get("version", 1) != STORAGE_VERSION:
+        version = index.get("version", 1)
+        raise ValueError("Data-set split '%s' has storage version %d, prepare it again" % (path, version))
+    words = Embeddings.words_options()
+    if index["words"] != words:
+        raise ValueError("Data-set split '%s' was prepared with words %s instead of %s, prepare it again"
+                         % (path, index["words"], words))
+    return index
+
+
+def load_split(path: str) -> list:
+    index_path = os.path.join(path, INDEX)
+    if not os.path.isfile(index_path):
+        return []
+    index = load_index(path)
+    shards = {
+        (family, shard): dumpers.npy_load(os.path.join(path, "%s-%d.npy" % (family, shard)))
+        for family in FAMILIES
+        for shard in {record["shard"] for record in index["batches"]}}
+    batches = []
+    for record in index["batches"]:
+        arrays = []
+        for family in FAMILIES:
+            offset, shape = record[family]
+            size = int(np.prod(shape))
+            array = shards[family, record["shard"]][offset:offset + size].reshape(shape)
+            arrays.append(array)
+        batches.append(unflatten_batch(arrays, record["lengths"], record["strings"]))
+    return batches
+
+
+def dump_data_set(data_set: DataSet, path: str):
+    for name, batches in zip(DataSet._fields, data_set):
+        split_path = os.path.join(path, name)
+        if os.path.isdir(split_path):
+            shutil.rmtree(split_path)
+        dump_split(batches, split_path)
+
+
+def load_data_set(path: str, splits: Iterable[str] = DataSet._fields) -> DataSet:
+    splits = set(splits)
+    batches = (load_split(os.path.join(path, name)) if name in splits else [] for name in DataSet._fields)
+    return DataSet(*batches)
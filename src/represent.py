@@ -3,7 +3,7 @@ import numpy as np
 
 from analyser.Score import Score
 from analyser.misc import print_scores
-from analyser_main import sub
+from analyser_main import sub, results_store
 from utils import dumpers
 
 
@@ -28,7 +28,8 @@ def print_top_n(n):
                     break
         return top_values
 
-    results = dumpers.json_load("resources/analyser/results.json")
+    with results_store() as results:
+        results = list(results)
     top = top_n(results, n, key=lambda x: Score.value_of(x["scores"]["codes"]).F_score(1))
     for result in top:
         options = result["options"]
@@ -65,7 +66,8 @@ def net_params():
         "tokens_hidden_size",
         "strings_hidden_size"
     )
-    results = dumpers.json_load("resources/analyser/results.json")
+    with results_store() as results:
+        results = list(results)
     params = tuple(zip(*(sub(res["options"]) for res in results)))
     y = [Score.value_of(res["scores"]["codes"]).F_score(1) for res in results]
     return params, y, names
@@ -0,0 +1,55 @@
+import queue
+import threading
+from typing import Iterable, Any
+
+
+class Prefetcher:
+    _ITEM, _END, _ERROR = range(3)
+
+    def __init__(self, iterable: Iterable[Any], depth: int = 2):
+        assert depth > 0
+        self._iterable = iterable
+        self._queue = queue.Queue(depth)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._produce, daemon=True)
+        self._thread.start()
+
+    def _put(self, kind: int, value) -> bool:
+        while not self._stopped.is_set():
+            try:
+                self._queue.put((kind, value), timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self):
+        try:
+            for item in self._iterable:
+                if not self._put(Prefetcher._ITEM, item):
+                    return
+            self._put(Prefetcher._END, None)
+        except BaseException as ex:
+            self._put(Prefetcher._ERROR, ex)
+
+    def __iter__(self):
+        try:
+            while True:
+                kind, value = self._queue.get()
+                if kind == Prefetcher._END:
+                    return
+                if kind == Prefetcher._ERROR:
+                    raise value
+                yield value
+        finally:
+            self.close()
+
+    def close(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
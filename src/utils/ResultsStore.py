@@ -0,0 +1,64 @@
+import json
+import sqlite3
+from typing import Iterable, Callable
+
+
+class ResultsStore:
+    def __init__(self, path: str, timeout: float = 60):
+        self.path = path
+        self._connection = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "key TEXT NOT NULL, "
+            "result TEXT NOT NULL)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS results_key ON results (key)")
+
+    @staticmethod
+    def key(value) -> str:
+        return json.dumps(value)
+
+    def append(self, key, result: dict):
+        self.extend(((key, result),))
+
+    def extend(self, results: Iterable[tuple]):
+        rows = [(self.key(key), json.dumps(result)) for key, result in results]
+        with self._connection:
+            self._connection.execute("BEGIN IMMEDIATE")
+            self._connection.executemany("INSERT INTO results (key, result) VALUES (?, ?)", rows)
+
+    def populate(self, results: Callable[[], Iterable[tuple]]) -> bool:
+        # the emptiness check and the insert share one write transaction, so concurrent openers populate once
+        if not self.is_empty():
+            return False
+        with self._connection:
+            self._connection.execute("BEGIN IMMEDIATE")
+            if not self.is_empty():
+                return False
+            rows = [(self.key(key), json.dumps(result)) for key, result in results()]
+            self._connection.executemany("INSERT INTO results (key, result) VALUES (?, ?)", rows)
+        return True
+
+    def is_empty(self) -> bool:
+        return self._connection.execute("SELECT 1 FROM results LIMIT 1").fetchone() is None
+
+    def contains(self, key) -> bool:
+        query = "SELECT 1 FROM results WHERE key = ? LIMIT 1"
+        return self._connection.execute(query, (self.key(key),)).fetchone() is not None
+
+    def __iter__(self) -> Iterable[dict]:
+        for result, in self._connection.execute("SELECT result FROM results ORDER BY id"):
+            yield json.loads(result)
+
+    def __len__(self):
+        return self._connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -1,115 +1,178 @@
 import re
+from typing import Iterable, List
 
 from contants import *
+from utils.wrappers import static, memoize
 
 
+def symbols_pattern() -> str:
+    complex_logic = ('!=', '?=', '==', '<=>', '=>', '<=', '>=', "->", "<-", "<->", "===")
+    complex_op = ('+=', '-=', '&=', '^=', '/=', '*=', '%=', '@=', '--', '++', '?:', ":-", "::-", ":=", "::=")
+    brackets = ('<', '>', '(', ')', '{', '}', '[', ']')
+    operators = ('!', '=', '?', '^', '`', '%', '$', '*', '#', '/', '\\', '&')
+    punctuations = ('.', ',', ':', ';')
+    quotes = ("'", '"')
+    literals = complex_logic + complex_op + brackets + operators + punctuations + quotes
+    escaped = ("".join("\\" + ch for ch in literal) for literal in literals)
+    # the lookahead rejects positions that can't start any literal before the alternation is tried
+    first = "".join(sorted({"\\" + literal[0] for literal in literals}))
+    return r"(?=[%s])(%s)" % (first, "|".join(escaped))
+
+
+@static(pattern=re.compile(r'"(?:[^"\n\r\\]|(?:"")|(?:\\(?:[^x]|x[0-9a-fA-F]+)))*"' + '|' +
+                           r"'(?:[^'\n\r\\]|(?:'')|(?:\\(?:[^x]|x[0-9a-fA-F]+)))*'"))
 def anonymize_quoted_strings(string: str) -> str:
-    pattern = re.compile(r'"(?:[^"\n\r\\]|(?:"")|(?:\\(?:[^x]|x[0-9a-fA-F]+)))*"' + '|' +
-                         r"'(?:[^'\n\r\\]|(?:'')|(?:\\(?:[^x]|x[0-9a-fA-F]+)))*'")
-    return re.sub(pattern, " %s " % STRING, string)
+    return anonymize_quoted_strings.pattern.sub(" %s " % STRING, string)
 
 
+@static(brackets=re.compile("[<>]"), skip_tags=("p", "b", "i", "u"))
 def anonymize_tags(string: str) -> str:
-    def skip():
-        result = pair is None
-        result = result or name in skip_tags
-        result = result or is_end_tag and string[pair[4] + 1:begin_index].isalpha()
-        result = result or not is_end_tag and string[end_index + 1:pair[3]].isalpha()
-        return result
-
-    skip_tags = ("p", "b", "i", "u")
+    def is_alpha(begin: int, end: int) -> bool:
+        # string[begin:end].isalpha() without the copy; begin is always right after a '>', so the scanned
+        # alphabetic runs never overlap and all scans together are linear
+        index = begin
+        while index < end and string[index].isalpha():
+            index += 1
+        return begin < end and index == end
+
     tags = []
     stacks = {}
     begin_index = None
-    for i, ch in enumerate(string):
-        if ch == "<":
+    for match in anonymize_tags.brackets.finditer(string):
+        i = match.start()
+        if string[i] == "<":
             begin_index = i
-        elif ch == ">" and begin_index is not None:
-            tag = string[begin_index:i + 1]
-            is_end_tag = tag[:2] == "</"
-            name = tag[2:-1] if is_end_tag else tag[1:-1]
-            if name not in stacks:
-                stacks[name] = []
-            tag = [is_end_tag, None, name, begin_index, i]
+        elif begin_index is not None:
+            is_end_tag = string.startswith("</", begin_index)
+            name = string[begin_index + 2:i] if is_end_tag else string[begin_index + 1:i]
+            tag = [is_end_tag, True, begin_index, i]
             if not is_end_tag:
-                index = len(tags)
-                stacks[name].append(index)
-            elif len(stacks[name]) > 0:
-                index = stacks[name][-1]
-                del stacks[name][-1]
-                tags[index][1] = tag
-                tag[1] = tags[index]
+                stacks.setdefault(name, []).append(tag)
+            elif len(stacks.get(name, ())) > 0:
+                pair = stacks[name].pop()
+                skip = name in anonymize_tags.skip_tags or is_alpha(pair[3] + 1, begin_index)
+                pair[1] = tag[1] = skip
             tags.append(tag)
     line = []
     index = 0
-    nesting = {}
-    in_block = lambda: any(inst > 0 for name, inst in nesting.items())
-    for is_end_tag, pair, name, begin_index, end_index in tags:
-        if not in_block():
+    depth = 0
+    for is_end_tag, skip, begin_index, end_index in tags:
+        if depth == 0:
             line.append(string[index:begin_index])
-        if not skip():
-            nesting[name] = nesting.get(name, 0) + (-1 if is_end_tag else 1)
-            if not in_block():
+        if not skip:
+            depth += -1 if is_end_tag else 1
+            if depth == 0:
                 line.append(" %s " % HTML_BLOCK)
         index = end_index + 1
-    line.append(" %s " % HTML_BLOCK if in_block() and not skip() else string[index:])
+    line.append(string[index:])
     return "".join(line)
 
 
+@static(escapes={
+    "&lt;": "<",
+    "&gt;": ">",
+    "&amp;": "&",
+    "&quot;": "\"",
+    "&ensp;": " ",
+    "&emsp;": " ",
+    "&thinsp;": " ",
+    "&nbsp;": " "},
+    pattern=re.compile(r"&(?:lt|gt|quot|ensp|emsp|thinsp|nbsp);|&amp;(?:(?:quot|ensp|emsp|thinsp|nbsp);)?"))
 def expand_html_escapes(string: str) -> str:
-    string = string.replace("&lt;", "<")
-    string = string.replace("&gt;", ">")
-    string = string.replace("&amp;", "&")
-    string = string.replace("&quot;", "\"")
-    string = string.replace("&ensp;", " ")
-    string = string.replace("&emsp;", " ")
-    string = string.replace("&thinsp;", " ")
-    string = string.replace("&nbsp;", " ")
-    return string
+    # Escapes were expanded one after another: "&amp;quot;" became '"', but "&amp;lt;" stayed "&lt;"
+    if "&" not in string:
+        return string
 
+    def expand(match) -> str:
+        escape = match.group()
+        if escape.startswith("&amp;"):
+            escape = "&" + escape[len("&amp;"):]
+        return expand_html_escapes.escapes.get(escape, escape)
 
+    return expand_html_escapes.pattern.sub(expand, string)
+
+
+@static(pattern=re.compile(r"(\{@|@\{).*?\}"))
 def anonymize_links(string: str) -> str:
-    # noinspection Annotator,Annotator
-    return re.sub("(\{@|@\{).*?\}", " %s " % LINK, string)
+    return anonymize_links.pattern.sub(" %s " % LINK, string)
 
 
+@static(pattern=re.compile(r"(?:/[a-zA-Z](?:[\w.]|\\\s)*){2,}"))
 def anonymize_paths(string: str) -> str:
-    return re.sub(r"(/[a-zA-Z](\w|\.|\\\s)*){2,}", " %s " % PATH, string)
+    return anonymize_paths.pattern.sub(" %s " % PATH, string)
 
 
+@static(word=re.compile(r"\w+"), segment=re.compile(r"[\w.@]*"), tail=re.compile(r"[\w./\\?=-]*"),
+        domain=re.compile(r"[a-z]{2}"))
 def anonymize_URLs(string: str) -> str:
-    pattern = re.compile(r"((\w+:(//|\\\\))?(\w+[\w.@]*\.[a-z]{2,3})(\w|\.|/|\\|\?|=|-)*)|(\w+:(//|\\\\))")
-    return re.sub(pattern, " %s " % URL, string)
+    # Linear scanner with the output of re.sub over
+    #   ((\w+:(//|\\\\))?(\w+[\w.@]*\.[a-z]{2,3})(\w|\.|/|\\|\?|=|-)*)|(\w+:(//|\\\\))
+    # which backtracks cubically on long words without a domain-like dot.
+    def host(begin: int):
+        # "\w+[\w.@]*\.[a-z]{2,3}" backtracks to the last dot of the [\w.@] run that is followed by
+        # two lowercase letters, the tail then takes the longest run of url characters after them
+        nonlocal dead
+        if dead[0] <= begin < dead[1] or anonymize_URLs.word.match(string, begin) is None:
+            return None
+        end = anonymize_URLs.segment.match(string, begin).end()
+        dot = string.rfind(".", begin + 1, end)
+        while dot != -1 and anonymize_URLs.domain.match(string, dot + 1) is None:
+            dot = string.rfind(".", begin + 1, dot)
+        if dot == -1:
+            # every later start inside this run fails the same way
+            dead = begin, end
+            return None
+        return anonymize_URLs.tail.match(string, dot + 3).end()
+
+    line = []
+    index = 0
+    position = 0
+    dead = 0, 0
+    while True:
+        word = anonymize_URLs.word.search(string, position)
+        if word is None:
+            break
+        begin, end = word.span()
+        scheme = string.startswith("://", end) or string.startswith(":\\\\", end)
+        match_end = host(end + 3) if scheme else None
+        if match_end is None:
+            match_end = host(begin)
+        if match_end is None and scheme:
+            match_end = end + 3
+        if match_end is None:
+            # starts inside the word share its host run and its scheme, so they fail too
+            position = end
+            continue
+        line.append(string[index:begin])
+        line.append(" %s " % URL)
+        index = position = match_end
+    line.append(string[index:])
+    return "".join(line)
 
 
+@static(pattern=re.compile(r"[+-]?[.,]?\d+(?:[.,]\d+)*"))
 def anonymize_numbers(string: str) -> str:
-    return re.sub(r"[+-]?\d*([.,]?\d+)+", " %s " % NUMBER, string)
+    return anonymize_numbers.pattern.sub(" %s " % NUMBER, string)
 
 
+@static(pattern=re.compile(symbols_pattern()))
 def expand_words_and_symbols(string: str) -> str:
-    complex_logic = ('!=', '?=', '==', '<=>', '=>', '<=', '>=', "->", "<-", "<->", "===")
-    complex_op = ('+=', '-=', '&=', '^=', '/=', '*=', '%=', '@=', '--', '++', '?:', ":-", "::-", ":=", "::=")
-    brackets = ('<', '>', '(', ')', '{', '}', '[', ']')
-    operators = ('!', '=', '?', '^', '`', '%', '$', '*', '#', '/', '\\', '&')
-    punctuations = ('.', ',', ':', ';')
-    quotes = ("'", '"')
-    literals = complex_logic + complex_op + brackets + operators + punctuations + quotes
-    escaped = ("".join("\\" + ch for ch in literal) for literal in literals)
-    pattern = re.compile(r"(%s)" % "|".join(escaped))
-    return re.sub(pattern, r" \1 ", string)
+    return expand_words_and_symbols.pattern.sub(r" \1 ", string)
 
 
+@static(pattern=re.compile(r"[\s\t]+"))
 def replace_long_spaces(string: str) -> str:
-    return re.sub("[\s\t]+", " ", string)
+    return replace_long_spaces.pattern.sub(" ", string)
 
 
 def expand_underscores(string: str):
     return string.replace("_", " ")
 
 
+@static(words=re.compile('(.)([A-Z][a-z]+)'), letters=re.compile('([a-z0-9])([A-Z])'))
 def expand_camel_case(string: str):
-    s1 = re.sub('(.)([A-Z][a-z]+)', r'\1 \2', string)
-    return re.sub('([a-z0-9])([A-Z])', r'\1 \2', s1)
+    s1 = expand_camel_case.words.sub(r'\1 \2', string)
+    return expand_camel_case.letters.sub(r'\1 \2', s1)
 
 
 def apply(string: str) -> str:
@@ -123,6 +186,34 @@ def apply(string: str) -> str:
     string = expand_underscores(string)
     string = expand_camel_case(string)
     string = expand_words_and_symbols(string)
-    string = replace_long_spaces(string)
-    string = string.strip().lower()
+    # replace_long_spaces, strip and lower fused into one split/join: str.split() and the "\s" class
+    # both break on str.isspace() characters, so the result is the same
+    string = " ".join(string.split()).lower()
     return string
+
+
+@memoize.function(1 << 16)
+def memoized_apply(string: str) -> str:
+    return apply(string)
+
+
+@static(texts=0, duplicates=0)
+def apply_many(texts: Iterable[str]) -> List[str]:
+    texts = list(texts)
+    unique = dict.fromkeys(texts)
+    apply_many.texts += len(texts)
+    apply_many.duplicates += len(texts) - len(unique)
+    for text in unique:
+        unique[text] = memoized_apply(text)
+    return [unique[text] for text in texts]
+
+
+def statistic() -> dict:
+    statistic = memoized_apply.cache.statistic()
+    return {
+        "texts": apply_many.texts,
+        "duplicates": apply_many.duplicates,
+        "hits": statistic["hits"],
+        "misses": statistic["misses"],
+        "hit_rate": statistic["hit_rate"],
+        "cache_size": statistic["size"]}
@@ -1,5 +1,8 @@
 import _pickle as pickle
 import json
+from typing import List
+
+import numpy as np
 
 
 def pkl_dump(instance, path: str):
@@ -24,6 +27,84 @@ def json_load(path: str):
     return instance
 
 
+def json_iter(path: str, chunk_size: int = 1 << 16):
+    decoder = json.JSONDecoder()
+    with open(path, "r") as file:
+        buffer = ""
+        index = 0
+        eof = False
+
+        def read():
+            nonlocal buffer, index, eof
+            chunk = file.read(chunk_size)
+            eof = len(chunk) == 0
+            buffer = buffer[index:] + chunk
+            index = 0
+
+        def skip() -> str:
+            nonlocal index
+            while True:
+                while index < len(buffer) and buffer[index].isspace():
+                    index += 1
+                if index < len(buffer):
+                    return buffer[index]
+                if eof:
+                    raise ValueError("Unexpected end of JSON array in '%s'" % path)
+                read()
+
+        def value():
+            nonlocal index
+            while True:
+                skip()
+                try:
+                    instance, end = decoder.raw_decode(buffer, index)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                    end = None
+                # a number cut by the chunk boundary decodes as a shorter one, so it must be followed by a delimiter
+                cut = end is not None and isinstance(instance, (int, float)) and not isinstance(instance, bool) and \
+                      (end == len(buffer) or not (buffer[end].isspace() or buffer[end] in ",]"))
+                if end is None or (end == len(buffer) or cut) and not eof:
+                    read()
+                    continue
+                index = end
+                return instance
+
+        if skip() != "[":
+            raise ValueError("JSON array is expected in '%s'" % path)
+        index += 1
+        if skip() == "]":
+            return
+        while True:
+            yield value()
+            delimiter = skip()
+            if delimiter == "]":
+                return
+            if delimiter != ",":
+                raise ValueError("Delimiter ',' or ']' is expected instead of '%s' in '%s'" % (delimiter, path))
+            index += 1
+            if skip() == "]":
+                raise ValueError("Value is expected after ',' in '%s'" % path)
+
+
+def npy_dump(arrays: List[np.ndarray], path: str) -> List[int]:
+    offsets = [0]
+    for array in arrays:
+        offsets.append(offsets[-1] + array.size)
+    dtype = np.result_type(*arrays)
+    instance = np.lib.format.open_memmap(path, "w+", dtype, (offsets[-1],))
+    for offset, array in zip(offsets, arrays):
+        instance[offset:offset + array.size] = array.ravel()
+    instance.flush()
+    del instance
+    return offsets[:-1]
+
+
+def npy_load(path: str, mmap_mode: str = "r") -> np.ndarray:
+    return np.load(path, mmap_mode=mmap_mode)
+
+
 def json_print(instance, printer=print):
     for line in json.dumps(instance, indent=4).split("\n"):
         printer(line)
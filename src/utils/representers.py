@@ -0,0 +1,27 @@
+from contants import DESCRIPTION
+
+
+def hash_repr(method):
+    description = method[DESCRIPTION]
+    name = description["name"]
+    owner = description["owner"]
+    result = type_repr(description["type"])
+    parameters = description["parameters"]
+    parameters = [(parameter["name"], type_repr(parameter["type"])) for parameter in parameters]
+    parameters = ", ".join("%s: %s" % parameter for parameter in parameters)
+    description = "%s %s : %s(%s) %s" % (DESCRIPTION, owner, name, parameters, result)
+    return description
+
+
+def type_repr(string):
+    if string == 'B': return "byte"
+    if string == 'C': return "char"
+    if string == 'D': return "double"
+    if string == 'F': return "float"
+    if string == 'I': return "int"
+    if string == 'J': return "long"
+    if string == 'S': return "short"
+    if string == 'Z': return "boolean"
+    if string == 'V': return "void"
+    if string == "void*": return "void"
+    return string.split("<")[0]
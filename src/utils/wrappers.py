@@ -1,5 +1,6 @@
-import collections
+import threading
 import time
+from collections import OrderedDict
 
 from logger import logger
 
@@ -89,6 +90,71 @@ class Timer:
             logger.info(formatter.format(self.name, formatted))
 
 
+class Cache:
+    def __init__(self, maxsize: int = None):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+        # one lock per key being computed, so concurrent callers wait for the first one instead of recomputing
+        self._computing = {}
+
+    def get(self, key, compute):
+        with self._lock:
+            if key in self._values:
+                return self._hit(key)
+            key_lock = self._computing.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                if key in self._values:
+                    return self._hit(key)
+                self.misses += 1
+            try:
+                value = compute()
+                with self._lock:
+                    self._values[key] = value
+                    if self.maxsize is not None and len(self._values) > self.maxsize:
+                        self._values.popitem(last=False)
+            finally:
+                with self._lock:
+                    if self._computing.get(key) is key_lock:
+                        del self._computing[key]
+        return value
+
+    def _hit(self, key):
+        self.hits += 1
+        self._values.move_to_end(key)
+        return self._values[key]
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def statistic(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+                "size": len(self._values),
+                "maxsize": self.maxsize}
+
+    def __len__(self):
+        return len(self._values)
+
+
+def hashable(args) -> bool:
+    try:
+        hash(args)
+    except TypeError:
+        return False
+    return True
+
+
 class memoize:
     @staticmethod
     def read_only_property(func):
@@ -123,32 +189,33 @@ class memoize:
         return _property
 
     @staticmethod
-    def method(func):
+    @optional_arg_decorator
+    def method(func, maxsize: int = None):
         attr_name = "_cache_" + func.__name__
+        lock = threading.Lock()
 
         def _method(self, *args):
-            if not isinstance(args, collections.Hashable):
+            if not hashable(args):
                 return func(self, *args)
-            if not hasattr(self, attr_name):
-                setattr(self, attr_name, {})
-            cache = getattr(self, attr_name)
-            if args not in cache:
-                value = func(self, *args)
-                cache[args] = value
-            return cache[args]
+            cache = getattr(self, attr_name, None)
+            if cache is None:
+                with lock:
+                    if not hasattr(self, attr_name):
+                        setattr(self, attr_name, Cache(maxsize))
+                cache = getattr(self, attr_name)
+            return cache.get(args, lambda: func(self, *args))
 
         return _method
 
     @staticmethod
-    def function(func):
-        cache = {}
+    @optional_arg_decorator
+    def function(func, maxsize: int = None):
+        cache = Cache(maxsize)
 
         def _function(*args):
-            if not isinstance(args, collections.Hashable):
+            if not hashable(args):
                 return func(*args)
-            if args not in cache:
-                value = func(*args)
-                cache[args] = value
-            return cache[args]
+            return cache.get(args, lambda: func(*args))
 
+        _function.cache = cache
         return _function
@@ -1,8 +1,10 @@
 import tensorflow as tf
 
 import prepares
-from contants import JAVA_DOC, EMBEDDINGS_PATH
+from analyser import Embeddings
+from contants import JAVA_DOC
 from utils import dumpers, generators
+from logger import logger
 from utils.wrappers import trace
 from word2vec import word2vec_optimized as word2vec
 
@@ -10,6 +12,11 @@ flags = tf.app.flags
 flags.DEFINE_bool('prepare', False, '')
 flags.DEFINE_bool('train', False, '')
 flags.DEFINE_bool('test', False, '')
+flags.DEFINE_bool('convert', False, '')
+flags.DEFINE_bool('reduce', False, '')
+flags.DEFINE_integer('dimension', 50, '')
+flags.DEFINE_string('reduction', 'pca', 'pca or random')
+flags.DEFINE_integer('workers', 1, '')
 FLAGS = flags.FLAGS
 
 FLAGS.save_path = 'resources/word2vec'
@@ -24,8 +31,8 @@ DATA_SET_PATH = 'resources/data-sets/data-set.json'
 
 @trace("PREPARE DATA-SET")
 def prepare():
-    methods = dumpers.json_load(DATA_SET_PATH)
-    methods = prepares.java_doc(methods)
+    methods = dumpers.json_iter(DATA_SET_PATH)
+    methods = prepares.java_doc(methods, FLAGS.workers)
     docs = (method[JAVA_DOC] for method in methods)
     with open(FLAGS.train_data, "w") as file:
         file.write("\n".join(docs))
@@ -43,12 +50,26 @@ def train():
         model.saver.save(session, MODEL_PATH)
         emb = model.w_in.eval(session)
         embeddings = {word.decode("utf8", errors='replace'): emb[i] for word, i in model.word2id.items()}
-    dumpers.pkl_dump(embeddings, EMBEDDINGS_PATH)
+        counts = {word.decode("utf8", errors='replace'): int(options.vocab_counts[i])
+                  for word, i in model.word2id.items()}
+    Embeddings.dump_words(embeddings, counts)
+
+
+@trace("CONVERT")
+def convert():
+    Embeddings.convert_words()
+
+
+@trace("REDUCE")
+def reduce():
+    retained = Embeddings.reduce_words(FLAGS.dimension, FLAGS.reduction)
+    logger.info("Reduced embeddings to %d dimensions, retained variance: %.4f" % (FLAGS.dimension, retained))
 
 
 @trace("TEST")
 def test():
-    embeddings = dumpers.pkl_load(EMBEDDINGS_PATH)
+    words = Embeddings.words()
+    embeddings = dict(zip(words.idx2name, words.matrix))
     clusters = generators.classifiers.kneighbors(embeddings, 0.1)
     generators.show.kneighbors(clusters)
 
@@ -56,4 +77,6 @@ def test():
 if __name__ == '__main__':
     if FLAGS.prepare: prepare()
     if FLAGS.train: train()
+    if FLAGS.convert: convert()
+    if FLAGS.reduce: reduce()
     if FLAGS.test: test()